@@ -1,10 +1,73 @@
 """
 See http://pbpython.com/advanced-excel-workbooks.html for details on this script
 
+format_excel is the function from the article. format_table does the same
+for any DataFrame, taking the column formats and totals from the data, and
+write_table uses it to save a summary as a styled Excel table. That is fine
+for small summaries but pandas holds the whole workbook in memory, so
+write_report is used for large ones. It streams the rows through xlsxwriter
+in constant_memory mode, which does not support tables, so it writes the
+totals and an autofilter instead and starts a new sheet when one is full.
 """
 from __future__ import print_function
+import argparse
+import numpy as np
 import pandas as pd
-from xlsxwriter.utility import xl_rowcol_to_cell
+import xlsxwriter
+from xlsxwriter.utility import xl_col_to_name, xl_rowcol_to_cell
+from data_loader import load
+from instrument import span, traced
+
+# Excel row limit. One row is used by the header and one by the totals
+MAX_ROWS = 1_048_576
+# Number of DataFrame rows converted for writing at one time
+BLOCK_SIZE = 10_000
+MAX_COLUMN_WIDTH = 50
+# Summaries up to this many rows are written as a formatted Excel table.
+# Larger ones are streamed by write_report
+TABLE_MAX_ROWS = 100_000
+
+# Function name used in the table total row and the SUBTOTAL code for it
+TOTAL_FUNCTIONS = {'sum': 109, 'average': 101, 'count': 102, 'max': 104,
+                   'min': 105}
+
+
+def column_formats(df):
+    """ Excel number format for each column based on the dtype
+    """
+    formats = {}
+    for col, dtype in df.dtypes.items():
+        if pd.api.types.is_float_dtype(dtype):
+            formats[col] = {'num_format': 42, 'align': 'center'}
+        elif pd.api.types.is_integer_dtype(dtype):
+            formats[col] = {'num_format': '#,##0'}
+        elif pd.api.types.is_datetime64_any_dtype(dtype):
+            formats[col] = {'num_format': 'yyyy-mm-dd'}
+        else:
+            formats[col] = {}
+    return formats
+
+
+def column_widths(df, sample_rows=1000):
+    """ Width for each column from the header and a sample of the values
+    """
+    widths = {}
+    sample = df.head(sample_rows)
+    for col in df.columns:
+        width = len(str(col))
+        if pd.api.types.is_numeric_dtype(df[col]):
+            width = max(width, 15)
+        elif len(sample):
+            width = max(width, sample[col].astype(str).str.len().max())
+        widths[col] = min(width + 2, MAX_COLUMN_WIDTH)
+    return widths
+
+
+def default_totals(df):
+    """ Sum every numeric column and label the first column Total
+    """
+    return {col: 'sum' for col in df.columns[1:]
+            if pd.api.types.is_numeric_dtype(df[col])}
 
 
 def format_excel(writer, df_size):
@@ -35,12 +98,170 @@ def format_excel(writer, df_size):
                                       'style': 'Table Style Medium 20'})
 
 
+def format_table(writer, df, sheet_name='summary', totals=None):
+    """ Like format_excel for any DataFrame written with
+    df.to_excel(writer, sheet_name=sheet_name, index=False).
+    totals is a dictionary of column -> total function, see TOTAL_FUNCTIONS
+    """
+    if totals is None:
+        totals = default_totals(df)
+    # Get the workbook and the summary sheet so we can add the formatting
+    workbook = writer.book
+    worksheet = writer.sheets[sheet_name]
+    formats = column_formats(df)
+    for i, (col, width) in enumerate(column_widths(df).items()):
+        worksheet.set_column(i, i, width, workbook.add_format(formats[col]))
+    # Add 1 to row so we can include a total
+    # subtract 1 from the column to handle because we don't care about index
+    table_end = xl_rowcol_to_cell(df.shape[0] + 1, df.shape[1] - 1)
+    # This assumes we start in the left hand corner
+    table_range = 'A1:{}'.format(table_end)
+    columns = []
+    for i, col in enumerate(df.columns):
+        column = {'header': str(col)}
+        if col in totals:
+            column['total_function'] = totals[col]
+        elif i == 0:
+            column['total_string'] = 'Total'
+        columns.append(column)
+    worksheet.add_table(table_range, {'columns': columns,
+                                      'autofilter': False,
+                                      'total_row': True,
+                                      'style': 'Table Style Medium 20'})
+
+
+@traced()
+def write_table(df, filename, sheet_name='summary', totals=None):
+    """ Save a DataFrame as a formatted Excel table with a total row
+    """
+    with pd.ExcelWriter(filename, engine='xlsxwriter') as writer:
+        df.to_excel(writer, sheet_name=sheet_name, index=False)
+        format_table(writer, df, sheet_name, totals)
+
+
+def _to_cells(block):
+    """ Convert a block of the DataFrame to rows of python values.
+    Dates become datetimes and missing values become blank cells
+    """
+    values = {}
+    for col in block.columns:
+        series = block[col]
+        if pd.api.types.is_datetime64_any_dtype(series):
+            arr = np.array(series.dt.to_pydatetime(), dtype=object)
+        else:
+            arr = series.to_numpy(dtype=object)
+        arr[pd.isna(series).to_numpy()] = None
+        values[col] = arr
+    return np.column_stack([values[c] for c in block.columns]).tolist()
+
+
+def _total(values, function):
+    """ Calculate a total the same way the SUBTOTAL function would
+    """
+    values = values[~pd.isna(values)]
+    if function == 'count':
+        return len(values)
+    if not len(values):
+        return 0
+    return {'sum': np.sum, 'average': np.mean, 'max': np.max,
+            'min': np.min}[function](values)
+
+
+@traced()
+def write_report(df, filename, sheet_name='summary', totals=None,
+                 max_rows=MAX_ROWS, block_size=BLOCK_SIZE):
+    """ Write a DataFrame to Excel without holding the workbook in memory.
+
+    Args:
+        df = data to write, the index is not written
+        filename = Excel file to create
+        sheet_name = name of the first sheet, more sheets get _2, _3 ...
+        totals = dictionary of column -> function in TOTAL_FUNCTIONS.
+                 Defaults to summing all of the numeric columns
+        max_rows = rows per sheet including the header and total rows
+        block_size = number of rows converted at one time
+    Returns:
+        list of the sheet names
+    """
+    if totals is None:
+        totals = default_totals(df)
+    rows_per_sheet = max_rows - 2
+    workbook = xlsxwriter.Workbook(filename, {'constant_memory': True})
+    header_fmt = workbook.add_format({'bold': True, 'bottom': 1})
+    formats = {col: workbook.add_format(props)
+               for col, props in column_formats(df).items()}
+    total_formats = {col: workbook.add_format(dict(props, bold=True, top=1))
+                     for col, props in column_formats(df).items()}
+    widths = column_widths(df)
+    sheet_names = []
+    for sheet_num, start in enumerate(range(0, max(len(df), 1),
+                                            rows_per_sheet)):
+        name = sheet_name if sheet_num == 0 else '{}_{}'.format(
+            sheet_name, sheet_num + 1)
+        sheet_names.append(name)
+        sheet_df = df.iloc[start:start + rows_per_sheet]
+        with span('write_sheet', rows_in=len(sheet_df), sheet=name):
+            worksheet = workbook.add_worksheet(name)
+            # Column formats must be set before any rows in constant_memory
+            # mode
+            for i, col in enumerate(df.columns):
+                worksheet.set_column(i, i, widths[col], formats[col])
+            worksheet.write_row(0, 0, [str(c) for c in df.columns],
+                                header_fmt)
+            worksheet.freeze_panes(1, 0)
+            row = 1
+            for block_start in range(0, len(sheet_df), block_size):
+                block = sheet_df.iloc[block_start:block_start + block_size]
+                for values in _to_cells(block):
+                    worksheet.write_row(row, 0, values)
+                    row += 1
+            last_row = row - 1
+            # Write the totals as formulas with the value already calculated
+            for i, col in enumerate(df.columns):
+                if col in totals:
+                    col_name = xl_col_to_name(i)
+                    formula = '=SUBTOTAL({},{}2:{}{})'.format(
+                        TOTAL_FUNCTIONS[totals[col]], col_name, col_name,
+                        last_row + 1)
+                    value = _total(sheet_df[col].to_numpy(), totals[col])
+                    worksheet.write_formula(row, i, formula,
+                                            total_formats[col], value)
+                elif i == 0:
+                    worksheet.write_string(row, i, 'Total',
+                                           total_formats[col])
+            worksheet.autofilter(0, 0, last_row, len(df.columns) - 1)
+    workbook.close()
+    return sheet_names
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(description='Summarize sales in Excel')
+    parser.add_argument('--infile', default='sample-salesv3.xlsx')
+    parser.add_argument('--by', default='name',
+                        help='Column to summarize by, for example sku')
+    parser.add_argument('-o', default='sales_summary.xlsx', help='Output file')
+    parser.add_argument('--max-rows', type=int, default=MAX_ROWS,
+                        help='Rows per sheet before starting a new one')
+    return parser.parse_args()
+
+
 if __name__ == "__main__":
-    sales_df = pd.read_excel('https://github.com/chris1610/pbpython/blob/master/data/sample-salesv3.xlsx?raw=true')
-    sales_summary = sales_df.groupby(['name'])['ext price'].agg(['sum', 'mean'])
+    args = parse_args()
+    sales_df = load(args.infile)
+    with span('summarize', rows_in=len(sales_df)) as s:
+        sales_summary = sales_df.groupby([args.by])['ext price'].agg(
+            ['sum', 'mean'])
+        s.rows_out = len(sales_summary)
     # Reset the index for consistency when saving in Excel
     sales_summary.reset_index(inplace=True)
-    writer = pd.ExcelWriter('sales_summary.xlsx', engine='xlsxwriter')
-    sales_summary.to_excel(writer, 'summary', index=False)
-    format_excel(writer, sales_summary.shape)
-    writer.save()
+    # Use the headers from the article
+    sales_summary.columns = ['account' if args.by == 'name' else args.by,
+                             'Total Sales', 'Average Sales']
+    totals = {'Total Sales': 'sum', 'Average Sales': 'average'}
+    if len(sales_summary) <= min(TABLE_MAX_ROWS, args.max_rows - 2):
+        write_table(sales_summary, args.o, totals=totals)
+    else:
+        write_report(sales_summary, args.o, totals=totals,
+                     max_rows=args.max_rows)
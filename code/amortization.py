@@ -0,0 +1,203 @@
+"""
+Vectorized mortgage amortization schedules.
+
+See https://pbpython.com/amortization-model-revised.html and the
+Amortization-Corrected-Final notebook for the background.
+
+The notebook builds each schedule one period at a time with a python
+generator. Here every schedule is an array and many (principal, rate,
+term, additional payment) scenarios are computed at once as a 2D array
+with one row per scenario and one column per period.
+
+By default the balances come from the closed form annuity formula. Pass
+exact=True to round the interest to the cent each period like the notebook
+does. That version still works on all of the scenarios at once but has to
+step through the periods.
+"""
+from __future__ import print_function
+from datetime import date
+import numpy as np
+import pandas as pd
+
+COLUMNS = ["Begin Balance", "Payment", "Interest", "Principal",
+           "Additional_Payment", "End Balance"]
+
+# Balances below half a cent are treated as paid off
+PAID_OFF = 0.005
+
+
+def payment(principal, interest_rate, years, annual_payments=12):
+    """ Payment per period rounded to the cent. Same as the notebook's
+    -round(np.pmt(...), 2) but works on arrays
+    """
+    principal, rate, years = np.broadcast_arrays(
+        np.asarray(principal, dtype=float),
+        np.asarray(interest_rate, dtype=float) / annual_payments,
+        np.asarray(years, dtype=float))
+    periods = years * annual_payments
+    with np.errstate(divide='ignore', invalid='ignore'):
+        pmt = np.where(rate == 0, principal / periods,
+                       principal * rate / (1 - (1 + rate)**-periods))
+    return np.round(pmt, 2)
+
+
+def payment_dates(start_date, periods, annual_payments=12):
+    """ Return a DatetimeIndex of the payment dates.
+    Works like adding relativedelta(months=1) to the prior date each period.
+    Once a short month moves the day back (Jan 31 -> Feb 29) it stays there.
+    """
+    if 12 % annual_payments:
+        raise ValueError("annual_payments must divide evenly into 12 months")
+    step = 12 // annual_payments
+    start = np.datetime64(pd.Timestamp(start_date).date(), 'D')
+    start_month = start.astype('datetime64[M]')
+    day = (start - start_month.astype('datetime64[D]')).astype(int)
+    months = start_month + np.arange(periods) * step
+    first = months.astype('datetime64[D]')
+    days_in_month = ((months + 1).astype('datetime64[D]') - first).astype(int)
+    day = np.minimum.accumulate(np.minimum(day, days_in_month - 1))
+    return pd.DatetimeIndex(first + day)
+
+
+def _closed_form(principal, rate, pmt, addl, periods):
+    """ Schedule arrays using the closed form balance after k payments
+    """
+    total_pmt = pmt + addl
+    k = np.arange(periods + 1)
+    growth = (1 + rate[:, None])**k
+    with np.errstate(divide='ignore', invalid='ignore'):
+        balance = np.where(
+            rate[:, None] == 0,
+            principal[:, None] - total_pmt[:, None] * k,
+            principal[:, None] * growth
+            - total_pmt[:, None] * (growth - 1) / rate[:, None])
+    beg = balance[:, :-1]
+    active = beg > PAID_OFF
+    beg = np.where(active, beg, 0)
+    interest = rate[:, None] * beg
+    pmt_k = np.minimum(pmt[:, None], beg + interest)
+    principal_k = pmt_k - interest
+    addl_k = np.minimum(addl[:, None], beg - principal_k)
+    end = beg - principal_k - addl_k
+    return [beg, pmt_k, interest, principal_k, addl_k, end], active
+
+
+def _exact(principal, rate, pmt, addl, periods):
+    """ Schedule arrays with the interest rounded each period like the
+    notebook's amortize() generator
+    """
+    beg = principal.copy()
+    columns = [[] for _ in COLUMNS]
+    active_list = []
+    for _ in range(periods):
+        active = beg > 0
+        if not active.any():
+            break
+        beg = np.where(active, beg, 0)
+        interest = np.round(rate * beg, 2)
+        pmt_k = np.minimum(pmt, beg + interest)
+        principal_k = pmt_k - interest
+        addl_k = np.minimum(addl, beg - principal_k)
+        end = beg - (principal_k + addl_k)
+        for col, values in zip(columns, [beg, pmt_k, interest, principal_k,
+                                         addl_k, end]):
+            col.append(np.where(active, values, 0))
+        active_list.append(active)
+        beg = end
+    return ([np.stack(c, axis=1) for c in columns],
+            np.stack(active_list, axis=1))
+
+
+def amortize_batch(principal, interest_rate, years, addl_principal=0,
+                   annual_payments=12, exact=False):
+    """ Calculate the schedules for many loans at once.
+    All of the arguments can be scalars or arrays and are broadcast together.
+
+    Returns a dictionary with a 2D array (scenarios x periods) for each of
+    the schedule columns, the number of payments and the fixed payment for
+    each scenario. Periods after the loan is paid off are 0.
+    """
+    principal, rate, years, addl = [a.ravel() for a in np.broadcast_arrays(
+        np.asarray(principal, dtype=float),
+        np.asarray(interest_rate, dtype=float) / annual_payments,
+        np.asarray(years, dtype=float),
+        np.asarray(addl_principal, dtype=float))]
+    pmt = payment(principal, rate * annual_payments, years, annual_payments)
+    # Rounding the payment can leave a few cents for one more period
+    periods = int((years * annual_payments).max()) + 1
+    if exact:
+        values, active = _exact(principal, rate, pmt, addl, periods)
+    else:
+        values, active = _closed_form(principal, rate, pmt, addl, periods)
+    num_payments = active.sum(axis=1)
+    # Trim any trailing periods that no loan uses
+    last = max(int(num_payments.max()), 1)
+    result = {col: v[:, :last] for col, v in zip(COLUMNS, values)}
+    result["Num Payments"] = num_payments
+    result["Fixed Payment"] = pmt
+    return result
+
+
+def scenario_summary(principal, interest_rate, years, addl_principal=0,
+                     annual_payments=12, start_date=None, exact=False):
+    """ Return a DataFrame with the summary stats for every scenario.
+    Matches the stats Series returned by amortization_table
+    """
+    if start_date is None:
+        start_date = date.today()
+    principal, rate, years, addl = [a.ravel() for a in np.broadcast_arrays(
+        np.asarray(principal, dtype=float),
+        np.asarray(interest_rate, dtype=float),
+        np.asarray(years, dtype=float),
+        np.asarray(addl_principal, dtype=float))]
+    result = amortize_batch(principal, rate, years, addl, annual_payments,
+                            exact)
+    num_payments = result["Num Payments"]
+    dates = payment_dates(start_date, result["Interest"].shape[1],
+                          annual_payments)
+    return pd.DataFrame({
+        "Payoff Date": dates[np.maximum(num_payments - 1, 0)],
+        "Num Payments": num_payments,
+        "Interest Rate": rate,
+        "Years": years,
+        "Principal": principal,
+        "Payment": result["Fixed Payment"],
+        "Additional Payment": addl,
+        "Total Interest": result["Interest"].sum(axis=1)
+    })
+
+
+def amortization_table(principal, interest_rate, years, addl_principal=0,
+                       annual_payments=12, start_date=None, exact=True):
+    """ Drop in replacement for the notebook function.
+    Returns the schedule DataFrame and a Series of summary stats
+    """
+    if start_date is None:
+        start_date = date.today()
+    result = amortize_batch(principal, interest_rate, years, addl_principal,
+                            annual_payments, exact)
+    n = int(result["Num Payments"][0])
+    schedule = pd.DataFrame({col: result[col][0, :n] for col in COLUMNS})
+    schedule.insert(0, "Month", payment_dates(start_date, n, annual_payments))
+    schedule.insert(0, "Period", np.arange(1, n + 1))
+    stats = pd.Series([schedule["Month"].iloc[-1], n, interest_rate, years,
+                       principal, result["Fixed Payment"][0], addl_principal,
+                       schedule["Interest"].sum()],
+                      index=["Payoff Date", "Num Payments", "Interest Rate",
+                             "Years", "Principal", "Payment",
+                             "Additional Payment", "Total Interest"])
+    return schedule, stats
+
+
+if __name__ == "__main__":
+    schedule, stats = amortization_table(700000, .04, 30, addl_principal=200,
+                                         start_date=date(2016, 1, 1))
+    print(stats)
+    print(schedule.tail())
+    # Price a grid of scenarios in one call
+    rates, terms, extra = np.meshgrid(np.arange(.03, .07, .0025),
+                                      [10, 15, 20, 30],
+                                      np.arange(0, 1000, 50))
+    summary = scenario_summary(250000, rates, terms, extra,
+                               start_date=date(2016, 1, 1))
+    print(summary.describe())
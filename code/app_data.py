@@ -0,0 +1,43 @@
+"""
+The pandas steps of the winepicker.py and stacked_bar_interactive.py apps.
+
+Both apps build their bokeh or dash layout as soon as they are imported,
+so the filtering and pivoting they do on every callback lives here, where
+it can be imported and timed by benchmarks.py without starting a server.
+"""
+import pandas as pd
+
+
+def filter_reviews(df, max_price, province_val="All", title_val=""):
+    """ Filter the wine reviews by maximum price, province and a string in
+    the title. Return a dataframe of the selected reviews
+    """
+    # Filter by price and province
+    if province_val == "All":
+        selected = df[df.price <= max_price]
+    else:
+        selected = df[(df.province == province_val) & (df.price <= max_price)]
+
+    # Further filter by string in title if it is provided
+    if title_val != "":
+        selected = selected[selected.title.str.contains(title_val) == True]
+    return selected
+
+
+def funnel_pivot(df, Manager):
+    """ Pivot the sales funnel quantities by customer name and status for
+    one manager, or for everyone if Manager is All Managers
+    """
+    if Manager == "All Managers":
+        df_plot = df.copy()
+    else:
+        df_plot = df[df['Manager'] == Manager]
+
+    pv = pd.pivot_table(
+        df_plot,
+        index=['Name'],
+        columns=["Status"],
+        values=['Quantity'],
+        aggfunc=sum,
+        fill_value=0)
+    return pv
@@ -0,0 +1,617 @@
+"""
+Time the scripts in this repo against scaled up synthetic data.
+
+Every script is written against the small sample files in data/, which
+says nothing about how they behave with a year of transactions. The
+generators below build data with the same columns as those samples at any
+size, so nothing needs to be downloaded. The scripts that read Excel files
+are given files written from the generated data.
+
+Each benchmark sets up its data and returns the call to time. Every run is
+done in a fresh process so the peak memory of one benchmark does not carry
+over into the next. The best wall time of the repeats, the peak resident
+memory during the timed call and the rows per second are printed and
+added to a json history file, along with the change from the last run of
+the same benchmark and size.
+
+The winepicker and stacked_bar_interactive apps start a server as soon as
+they are imported, so their pandas steps are timed through app_data, which
+both apps call. The pandas_gui and pbp_proj functions are imported without
+Gooey or xlwings. Benchmarks that need a package that is not installed,
+such as pptx for create_ppt, are reported as skipped.
+
+Usage:
+    python benchmarks.py
+    python benchmarks.py funnel_pivot filter_reviews --rows 1000 10000000
+"""
+from __future__ import print_function
+import argparse
+from collections import namedtuple
+from concurrent.futures import ProcessPoolExecutor
+import importlib.util
+import io
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+try:
+    import resource
+except ImportError:
+    # Not available on Windows
+    resource = None
+
+CODE_DIR = Path(__file__).resolve().parent
+HISTORY_FILE = 'benchmark_history.json'
+DEFAULT_ROWS = [1_000, 10_000, 100_000, 1_000_000]
+REPEAT = 3
+
+# Values used by the generators
+MANAGERS = ['Debra Henley', 'Fred Anderson', 'Lena Ortiz', 'Sam Patel']
+PRODUCTS = ['CPU', 'Maintenance', 'Monitor', 'Software']
+FUNNEL_STATUS = ['declined', 'pending', 'presented', 'won']
+CUSTOMER_STATUS = ['gold', 'silver', 'bronze']
+CATEGORIES = ['Belt', 'Shirt', 'Shoes']
+PROVINCES = ['South Australia', 'Victoria', 'Western Australia',
+             'New South Wales', 'Tasmania', 'Australia Other']
+VARIETIES = ['Shiraz', 'Chardonnay', 'Cabernet Sauvignon', 'Riesling',
+             'Pinot Noir', 'Grenache', 'Rose', 'Sauvignon Blanc']
+
+Benchmark = namedtuple('Benchmark', ['setup', 'requires', 'max_rows'])
+
+
+# Synthetic data generators
+
+def sales_transactions(rows, accounts=None, seed=0):
+    """ Transactions like sample-salesv3.xlsx and the sales-*-2014 files.
+    The date is an ISO string the same way it comes out of those files
+    """
+    rng = np.random.default_rng(seed)
+    accounts = accounts or max(20, rows // 100)
+    account_numbers = 100000 + 7 * np.arange(accounts)
+    names = np.array(['Customer {}'.format(i) for i in range(accounts)],
+                     dtype=object)
+    skus = np.array(['{}-{:05d}'.format(p, n) for p, n in
+                     zip(rng.choice(['S1', 'S2', 'B1'], 500),
+                         rng.integers(10000, 99999, 500))], dtype=object)
+    customer = rng.integers(0, accounts, rows)
+    quantity = rng.integers(1, 50, rows)
+    unit_price = rng.uniform(10, 100, rows).round(2)
+    seconds = np.sort(rng.integers(0, 365 * 24 * 3600, rows))
+    dates = np.datetime64('2014-01-01T00:00:00') + seconds
+    return pd.DataFrame({
+        'account number': account_numbers[customer],
+        'name': names[customer],
+        'sku': skus[rng.integers(0, len(skus), rows)],
+        'quantity': quantity,
+        'unit price': unit_price,
+        'ext price': (quantity * unit_price).round(2),
+        'date': np.datetime_as_string(dates)})
+
+
+def customer_status(sales, seed=0):
+    """ Account status like customer-status.xlsx for most of the customers
+    in a sales frame. The rest are left to the bronze default
+    """
+    rng = np.random.default_rng(seed)
+    customers = sales[['account number', 'name']].drop_duplicates()
+    customers = customers.sample(frac=.8, random_state=seed)
+    return customers.assign(
+        status=rng.choice(CUSTOMER_STATUS, len(customers))).reset_index(
+            drop=True)
+
+
+def sales_reps(rows, seed=0):
+    """ Transactions like sample-sales-reps.xlsx
+    """
+    rng = np.random.default_rng(seed)
+    df = sales_transactions(rows, seed=seed)
+    reps = np.array(['Rep {}'.format(i) for i in range(max(10, rows // 5000))],
+                    dtype=object)
+    df.insert(2, 'sales rep', reps[rng.integers(0, len(reps), rows)])
+    df.insert(4, 'category', rng.choice(CATEGORIES, rows))
+    return df.rename(columns={'name': 'customer name'})
+
+
+def sales_funnel(rows, seed=0):
+    """ Opportunities like salesfunnel.xlsx
+    """
+    rng = np.random.default_rng(seed)
+    accounts = max(20, rows // 50)
+    reps_per_manager = max(2, rows // 10000)
+    reps = np.array(['Rep {}'.format(i)
+                     for i in range(len(MANAGERS) * reps_per_manager)],
+                    dtype=object)
+    managers = np.repeat(MANAGERS, reps_per_manager)
+    account = rng.integers(0, accounts, rows)
+    # Each account belongs to one rep like the sample
+    rep = account % len(reps)
+    return pd.DataFrame({
+        'Account': 100000 + 7 * account,
+        'Name': np.array(['Customer {}'.format(i) for i in range(accounts)],
+                         dtype=object)[account],
+        'Rep': reps[rep],
+        'Manager': managers[rep],
+        'Product': rng.choice(PRODUCTS, rows),
+        'Quantity': rng.integers(1, 5, rows),
+        'Price': rng.choice([5000, 10000, 30000, 40000, 65000], rows),
+        'Status': rng.choice(FUNNEL_STATUS, rows)})
+
+
+def wine_reviews(rows, seed=0):
+    """ Reviews with the columns of Aussie_Wines_Plotting.csv that the
+    winepicker app uses
+    """
+    rng = np.random.default_rng(seed)
+    wineries = np.array(['Winery {}'.format(i)
+                         for i in range(max(50, rows // 100))], dtype=object)
+    winery = wineries[rng.integers(0, len(wineries), rows)]
+    variety = rng.choice(VARIETIES, rows).astype(object)
+    province = rng.choice(PROVINCES, rows).astype(object)
+    year = rng.integers(2000, 2017, rows).astype(str).astype(object)
+    colors = dict(zip(VARIETIES, ['#440154', '#46317e', '#365a8c', '#277e8e',
+                                  '#1fa187', '#4ac26d', '#9fd938',
+                                  '#fde725']))
+    return pd.DataFrame({
+        'points': rng.integers(80, 101, rows),
+        'price': rng.gamma(2, 20, rows).round(0),
+        'province': province,
+        'title': winery + ' ' + year + ' ' + variety + ' (' + province + ')',
+        'variety': variety,
+        'winery': winery,
+        'variety_color': pd.Series(variety).map(colors).to_numpy()})
+
+
+def markdown_doc(rows, seed=0):
+    """ A newsletter like md_to_email/sample_doc.md with rows lines of
+    content
+    """
+    rng = np.random.default_rng(seed)
+    lines = ['Title: Newsletter Number X', 'Date: 12-9-2019 10:04am',
+             'Template: newsletter', '']
+    for i in range(rows):
+        if i % 20 == 0:
+            lines.extend(['', '## Section {}'.format(i // 20), ''])
+        lines.append('* [Article {}](https://pbpython.com/article-{}.html) '
+                     'covers {} ways to use pandas.'.format(
+                         i, i, rng.integers(2, 10)))
+    return '\n'.join(lines) + '\n'
+
+
+# Benchmarks. Each setup takes the number of rows and a working directory
+# and returns the function to time
+
+def write_monthly_files(rows, workdir):
+    """ Write rows sales transactions to the workdir as twelve monthly
+    sales-*.xlsx files like the ones pandas_gui.py reads
+    """
+    sales = sales_transactions(rows)
+    size = -(-rows // 12)
+    for month, i in enumerate(range(0, rows, size), 1):
+        sales.iloc[i:i + size].to_excel(
+            os.path.join(workdir, 'sales-{:02d}-2014.xlsx'.format(month)),
+            index=False, engine='xlsxwriter')
+    return sales
+
+
+def combine_files_setup(rows, workdir):
+    """ pandas_gui.combine_files reading twelve monthly Excel files
+    """
+    from pandas_gui import combine_files
+    write_monthly_files(rows, workdir)
+    return lambda: combine_files(workdir)
+
+
+def add_customer_status_setup(rows, workdir):
+    """ pandas_gui.add_customer_status reading the customer file and
+    merging it with rows sales
+    """
+    from pandas_gui import add_customer_status
+    sales = sales_transactions(rows)
+    sales['date'] = pd.to_datetime(sales['date'])
+    customer_file = os.path.join(workdir, 'customer-status.xlsx')
+    customer_status(sales).to_excel(customer_file, index=False,
+                                    engine='xlsxwriter')
+    return lambda: add_customer_status(sales, customer_file)
+
+
+def save_results_setup(rows, workdir):
+    """ pandas_gui.save_results summarizing rows sales by customer status
+    """
+    from pandas_gui import add_customer_status, save_results
+    sales = sales_transactions(rows)
+    customer_file = os.path.join(workdir, 'customer-status.xlsx')
+    customer_status(sales).to_excel(customer_file, index=False,
+                                    engine='xlsxwriter')
+    sales = add_customer_status(sales, customer_file)
+    return lambda: save_results(sales, workdir)
+
+
+def create_pivot_setup(rows, workdir):
+    """ create_ppt.create_pivot on the salesfunnel columns
+    """
+    from create_ppt import create_pivot
+    df = sales_funnel(rows)
+    return lambda: create_pivot(df)
+
+
+def df_to_table_setup(rows, workdir):
+    """ create_ppt.df_to_table with a pivot of rows opportunities for one
+    manager
+    """
+    from pptx import Presentation
+    from pptx.util import Inches
+    from create_ppt import df_to_table
+    df = sales_funnel(rows)
+    table = pd.pivot_table(df, index=['Rep', 'Name', 'Product'],
+                           values=['Price', 'Quantity'], aggfunc='sum')
+    table = table.reset_index()
+
+    def run():
+        prs = Presentation()
+        slide = prs.slides.add_slide(prs.slide_layouts[5])
+        df_to_table(slide, table, Inches(0.25), Inches(1.5), Inches(9.25),
+                    Inches(5.0))
+        return prs
+    return run
+
+
+def filter_reviews_setup(rows, workdir):
+    """ app_data.filter_reviews, the filter behind winepicker.select_reviews,
+    with a province, price limit and title search selected
+    """
+    from app_data import filter_reviews
+    df = wine_reviews(rows)
+    return lambda: filter_reviews(df, 50, 'South Australia', 'Shiraz')
+
+
+def funnel_pivot_setup(rows, workdir):
+    """ app_data.funnel_pivot, the pivot behind
+    stacked_bar_interactive.update_graph, for All Managers
+    """
+    from app_data import funnel_pivot
+    df = sales_funnel(rows)
+    return lambda: funnel_pivot(df, 'All Managers')
+
+
+def bulletgraph_setup(rows, workdir):
+    """ Total the sales by rep and draw bullet_graph.bulletgraph for the
+    five largest reps
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    from bullet_graph import bulletgraph
+    df = sales_reps(rows)
+
+    def run():
+        totals = df.groupby('sales rep')['ext price'].sum().nlargest(5)
+        target = totals.mean()
+        data = [(rep, total, target) for rep, total in totals.items()]
+        limit = totals.max() * 1.2
+        fig = bulletgraph(data, limits=[limit * .5, limit * .75, limit],
+                          labels=['Poor', 'OK', 'Good'],
+                          palette=['#d9d9d9', '#bdbdbd', '#969696'])
+        fig.savefig(io.BytesIO(), format='png')
+        plt.close(fig)
+    return run
+
+
+def account_summary_setup(rows, workdir):
+    """ pbp_proj.account_summary, the query and summary behind
+    pbp_proj.summarize_sales, against a sqlite database of rows sales
+    """
+    import sqlite3
+    sys.path.insert(0, str(CODE_DIR / 'pbp_proj'))
+    from pbp_proj import account_summary
+    sales = sales_transactions(rows).rename(columns={
+        'account number': 'account', 'ext price': 'ext-price'})
+    conn = sqlite3.connect(os.path.join(workdir, 'pbp_proj.db'))
+    sales.to_sql('sales', conn, index=False)
+    account = sales['account'].iloc[0]
+    return lambda: account_summary(conn, account, '2014-01-01', '2014-12-31')
+
+
+def create_HTML_setup(rows, workdir):
+    """ md_to_email.email_gen.create_HTML on a newsletter with rows lines,
+    without the parsed document cache
+    """
+    sys.path.insert(0, str(CODE_DIR / 'md_to_email'))
+    from email_gen import create_HTML
+    # premailer warns about every mail client specific css property
+    logging.getLogger('CSSUTILS').setLevel(logging.ERROR)
+    doc = Path(workdir) / 'newsletter.md'
+    doc.write_text(markdown_doc(rows))
+    template = (CODE_DIR / 'md_to_email' / 'template.html').read_text()
+    (Path(workdir) / 'template.html').write_text(template)
+    # The template is loaded from the current directory
+    os.chdir(workdir)
+    config = argparse.Namespace(doc=str(doc), t='template.html',
+                                o=str(Path(workdir) / 'newsletter.html'),
+                                c=None, no_cache=True)
+    return lambda: create_HTML(config)
+
+
+def commission_rules_setup(rows, workdir):
+    """ commission_rules.RuleEngine.apply with the notebook rules
+    """
+    from commission_rules import RuleEngine
+    df = sales_reps(rows)
+    engine = RuleEngine()
+    return lambda: engine.apply(df)
+
+
+def excel_diff_setup(rows, workdir):
+    """ excel_diff.diff_frames with 1% of the rows changed, added or
+    dropped
+    """
+    from excel_diff import diff_frames
+    old = sales_transactions(rows)
+    old['id'] = np.arange(rows)
+    new = old.sample(frac=.99, random_state=0)
+    changed = new.sample(frac=.01, random_state=1).index
+    new.loc[changed, 'quantity'] += 1
+    added = old.tail(rows // 100 + 1).assign(id=lambda d: d['id'] + rows)
+    new = pd.concat([new, added], ignore_index=True)
+    return lambda: diff_frames(old, new, 'id')
+
+
+def natural_breaks_setup(rows, workdir):
+    """ natural_breaks.natural_bins on the ext price column
+    """
+    from natural_breaks import natural_bins
+    prices = sales_transactions(rows)['ext price']
+    return lambda: natural_bins(prices, 5, cache_dir=None)
+
+
+def category_encoding_setup(rows, workdir):
+    """ category_encoding one hot encoding of the text columns
+    """
+    from category_encoding import CategoryEncoder
+    df = sales_reps(rows)
+    columns = ['customer name', 'sales rep', 'sku', 'category']
+
+    def run():
+        encoder = CategoryEncoder(columns).fit(df)
+        return encoder.one_hot(df)
+    return run
+
+
+def write_report_setup(rows, workdir):
+    """ advanced_excel.write_report of a rows line summary
+    """
+    from advanced_excel import write_report
+    df = sales_transactions(rows)
+    out_file = os.path.join(workdir, 'sales_summary.xlsx')
+    return lambda: write_report(df, out_file)
+
+
+BENCHMARKS = {
+    # Reading and writing Excel is slow, so the files are kept small
+    'combine_files': Benchmark(combine_files_setup,
+                               ('openpyxl', 'xlsxwriter'), 10**5),
+    'add_customer_status': Benchmark(add_customer_status_setup,
+                                     ('openpyxl', 'xlsxwriter'), 10**7),
+    'save_results': Benchmark(save_results_setup,
+                              ('openpyxl', 'xlsxwriter'), 10**7),
+    'create_pivot': Benchmark(create_pivot_setup, ('pptx', 'seaborn'),
+                              10**7),
+    'df_to_table': Benchmark(df_to_table_setup, ('pptx', 'seaborn'), 10**4),
+    'filter_reviews': Benchmark(filter_reviews_setup, (), 10**7),
+    'funnel_pivot': Benchmark(funnel_pivot_setup, (), 10**7),
+    'bulletgraph': Benchmark(bulletgraph_setup, ('matplotlib', 'seaborn'),
+                             10**7),
+    'account_summary': Benchmark(account_summary_setup, (), 10**7),
+    'create_HTML': Benchmark(create_HTML_setup,
+                             ('markdown2', 'jinja2', 'premailer', 'bs4'),
+                             10**4),
+    'commission_rules': Benchmark(commission_rules_setup, ('pyarrow',),
+                                  10**7),
+    'excel_diff': Benchmark(excel_diff_setup, (), 10**7),
+    'natural_breaks': Benchmark(natural_breaks_setup, (), 10**7),
+    'category_encoding': Benchmark(category_encoding_setup, ('scipy',),
+                                   10**7),
+    # Excel only holds about a million rows per sheet
+    'write_report': Benchmark(write_report_setup, ('xlsxwriter', 'pyarrow'),
+                              10**6),
+}
+
+
+def missing_modules(requires):
+    """ The required modules that are not installed
+    """
+    return [m for m in requires if importlib.util.find_spec(m) is None]
+
+
+def reset_peak_rss():
+    """ Reset the peak memory so it only covers what runs next.
+    Only possible on Linux, elsewhere the peak includes the setup
+    """
+    try:
+        with open('/proc/self/clear_refs', 'w') as f:
+            f.write('5')
+    except OSError:
+        pass
+
+
+def peak_rss():
+    """ Peak resident memory of this process in MB
+    """
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    if resource is None:
+        return None
+    usage = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # Linux reports kilobytes and macOS bytes
+    return usage / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def run_benchmark(task):
+    """ Set up and time one benchmark at one size. Runs in its own process
+    """
+    name, rows, repeat = task
+    sys.path.insert(0, str(CODE_DIR))
+    result = {'name': name, 'rows': rows}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            func = BENCHMARKS[name].setup(rows, workdir)
+            times = []
+            reset_peak_rss()
+            for _ in range(repeat):
+                start = time.perf_counter()
+                func()
+                times.append(time.perf_counter() - start)
+            seconds = min(times)
+            result.update(status='ok', seconds=seconds,
+                          mean_seconds=sum(times) / len(times),
+                          peak_rss_mb=peak_rss(),
+                          rows_per_second=rows / seconds if seconds else None)
+            # Leave the folder so it can be removed on Windows
+            os.chdir(tempfile.gettempdir())
+    except Exception as e:
+        result.update(status='error',
+                      message='{}: {}'.format(type(e).__name__, e))
+    return result
+
+
+def run_benchmarks(names, row_counts, repeat=REPEAT):
+    """ Run every benchmark at every size, each in a new process.
+    Returns a list of result dictionaries
+    """
+    results = []
+    context = multiprocessing.get_context('spawn')
+    for name in names:
+        benchmark = BENCHMARKS[name]
+        missing = missing_modules(benchmark.requires)
+        for rows in row_counts:
+            if missing:
+                results.append({'name': name, 'rows': rows,
+                                'status': 'skipped',
+                                'message': 'needs ' + ', '.join(missing)})
+                continue
+            if rows > benchmark.max_rows:
+                results.append({'name': name, 'rows': rows,
+                                'status': 'skipped',
+                                'message': 'more than {:,} rows'.format(
+                                    benchmark.max_rows)})
+                continue
+            with ProcessPoolExecutor(max_workers=1,
+                                     mp_context=context) as executor:
+                result = executor.submit(run_benchmark,
+                                         (name, rows, repeat)).result()
+            results.append(result)
+            print('{:<20} {:>10,} rows  {}'.format(
+                name, rows, '{:.3f}s'.format(result['seconds'])
+                if result['status'] == 'ok' else result['message']))
+    return results
+
+
+def read_history(history_file):
+    """ Return the list of earlier runs
+    """
+    if not os.path.exists(history_file):
+        return []
+    with open(history_file) as f:
+        return json.load(f)
+
+
+def git_commit():
+    """ The current commit of the repo, if there is one
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'],
+                              cwd=CODE_DIR, capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def save_history(history_file, history, results):
+    """ Add the results to the history. The file is written to a temporary
+    name and renamed into place
+    """
+    history = history + [{
+        'timestamp': datetime.now().isoformat(timespec='seconds'),
+        'commit': git_commit(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'machine': platform.node(),
+        'results': results}]
+    tmp_file = '{}.{}.tmp'.format(history_file, os.getpid())
+    with open(tmp_file, 'w') as f:
+        json.dump(history, f, indent=2)
+    os.replace(tmp_file, history_file)
+
+
+def compare(results, history):
+    """ Summary table with the change in wall time from the last run of the
+    same benchmark and size
+    """
+    previous = {}
+    for run in history:
+        for r in run['results']:
+            if r['status'] == 'ok':
+                previous[(r['name'], r['rows'])] = r['seconds']
+    table = pd.DataFrame(results)
+    for col in ['seconds', 'peak_rss_mb', 'rows_per_second', 'message']:
+        if col not in table:
+            table[col] = np.nan
+    table['previous'] = [previous.get((r['name'], r['rows']))
+                         for r in results]
+    table['change'] = table['seconds'] / table['previous'] - 1
+    return table[['name', 'rows', 'status', 'seconds', 'peak_rss_mb',
+                  'rows_per_second', 'previous', 'change', 'message']]
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Time the scripts against synthetic data')
+    parser.add_argument('names', nargs='*',
+                        help='Benchmarks to run, defaults to all of them')
+    parser.add_argument('--rows', type=int, nargs='+', default=DEFAULT_ROWS,
+                        help='Data sizes, up to 10000000')
+    parser.add_argument('--repeat', type=int, default=REPEAT,
+                        help='Times to run each benchmark, the best is kept')
+    parser.add_argument('--history', default=HISTORY_FILE,
+                        help='json file the results are added to')
+    parser.add_argument('--no-history', action='store_true',
+                        help='Do not save the results')
+    parser.add_argument('--list', action='store_true',
+                        help='List the benchmarks')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.list:
+        for name, benchmark in BENCHMARKS.items():
+            print('{:<20} {}'.format(name, ' '.join(
+                benchmark.setup.__doc__.split())))
+        sys.exit()
+    unknown = set(args.names) - set(BENCHMARKS)
+    if unknown:
+        sys.exit('Unknown benchmarks: {}'.format(', '.join(sorted(unknown))))
+    history = read_history(args.history)
+    results = run_benchmarks(args.names or list(BENCHMARKS), args.rows,
+                             args.repeat)
+    with pd.option_context('display.width', 200,
+                           'display.float_format', '{:,.3f}'.format):
+        print(compare(results, history).to_string(index=False))
+    if not args.no_history:
+        save_history(args.history, history, results)
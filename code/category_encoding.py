@@ -0,0 +1,261 @@
+"""
+Encode categorical columns as ordinal codes, sparse one-hot or hashed
+features without making dense copies of the data.
+
+See https://pbpython.com/categorical-encoding.html and the
+Category-Encoding-Article notebook for the background.
+
+The notebook uses replace() with lookup dictionaries, pd.get_dummies and
+the sklearn encoders. Each of those makes a dense copy of the object
+columns and get_dummies creates a dense column for every value. Here each
+column is factorized once and the unique values are looked up in a saved
+vocabulary, so every output is built from the integer codes:
+
+    ordinal - the codes, -1 for missing or unknown values
+    one_hot - scipy.sparse matrix with one column per vocabulary value
+    hashed  - scipy.sparse matrix with a fixed number of hashed columns
+
+The vocabularies can be saved to a json file and loaded to encode later
+batches the same way without fitting again. partial_fit adds new values to
+the end of a vocabulary so the existing codes never change.
+"""
+from __future__ import print_function
+import argparse
+import json
+from pathlib import Path
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+AUTOS_URL = 'https://archive.ics.uci.edu/ml/machine-learning-databases/autos/imports-85.data'
+AUTOS_HEADERS = [
+    "symboling", "normalized_losses", "make", "fuel_type", "aspiration",
+    "num_doors", "body_style", "drive_wheels", "engine_location",
+    "wheel_base", "length", "width", "height", "curb_weight", "engine_type",
+    "num_cylinders", "engine_size", "fuel_system", "bore", "stroke",
+    "compression_ratio", "horsepower", "peak_rpm", "city_mpg", "highway_mpg",
+    "price"
+]
+
+# Default number of columns for the hashed features
+HASH_FEATURES = 2**18
+
+
+def code_dtype(num_categories):
+    """ Smallest signed int type that holds the codes and -1
+    """
+    for dtype in (np.int8, np.int16, np.int32):
+        if num_categories <= np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def factorize(series):
+    """ Return the codes and unique values of a column in one pass.
+    Categorical columns reuse their existing codes
+    """
+    if isinstance(series.dtype, pd.CategoricalDtype):
+        return series.cat.codes.to_numpy(), series.cat.categories
+    return pd.factorize(series)
+
+
+class CategoryEncoder(object):
+    """ Keeps the vocabulary of values for each column.
+
+    Args:
+        columns = columns to encode. Defaults to the object and category
+                  columns of the first data that is fit
+        categories = dictionary of column -> list of values in a fixed order,
+                     for example to encode num_cylinders from two to twelve
+    """
+
+    def __init__(self, columns=None, categories=None):
+        self.columns = list(columns) if columns is not None else None
+        self.categories = {}
+        self._index = {}
+        self.fixed = set()
+        for col, values in (categories or {}).items():
+            self._set_vocabulary(col, list(values))
+            self.fixed.add(col)
+
+    def _set_vocabulary(self, col, values):
+        self.categories[col] = values
+        self._index[col] = pd.Index(values)
+
+    def fit(self, df):
+        """ Build the vocabularies from scratch with the values sorted
+        """
+        for col in list(self.categories):
+            if col not in self.fixed:
+                del self.categories[col], self._index[col]
+        return self.partial_fit(df)
+
+    def partial_fit(self, df):
+        """ Add any new values in a batch to the end of the vocabularies
+        """
+        if self.columns is None:
+            # Text columns are str in pandas 3 and object before that
+            self.columns = list(df.select_dtypes(
+                include=['object', 'string', 'category']).columns)
+        for col in self.columns:
+            if col in self.fixed:
+                continue
+            _, uniques = factorize(df[col])
+            if col not in self.categories:
+                self._set_vocabulary(col, sorted(uniques))
+                continue
+            new = uniques[self._index[col].get_indexer(uniques) < 0]
+            if len(new):
+                self._set_vocabulary(col, self.categories[col] +
+                                     sorted(new))
+        return self
+
+    def codes(self, series, col=None):
+        """ Ordinal codes for a column, -1 for missing or unknown values
+        """
+        col = series.name if col is None else col
+        codes, uniques = factorize(series)
+        # The extra -1 at the end is picked up by the missing value code
+        lookup = np.append(self._index[col].get_indexer(uniques), -1)
+        return lookup[codes].astype(code_dtype(len(self.categories[col])))
+
+    def ordinal(self, df, columns=None):
+        """ DataFrame of the codes like sklearn's OrdinalEncoder
+        """
+        columns = self.columns if columns is None else columns
+        return pd.DataFrame({col: self.codes(df[col], col)
+                             for col in columns}, index=df.index)
+
+    def to_categorical(self, df, columns=None):
+        """ Return a copy of the DataFrame with the columns stored as
+        categoricals that use the saved vocabularies
+        """
+        columns = self.columns if columns is None else columns
+        df = df.copy()
+        for col in columns:
+            df[col] = pd.Categorical.from_codes(self.codes(df[col], col),
+                                                self.categories[col])
+        return df
+
+    def one_hot(self, df, columns=None):
+        """ Sparse one-hot matrix and the feature names.
+        Unknown and missing values are all zeros like
+        OneHotEncoder(handle_unknown='ignore')
+        """
+        columns = self.columns if columns is None else columns
+        blocks = []
+        names = []
+        for col in columns:
+            codes = self.codes(df[col], col).astype(np.int64)
+            known = codes >= 0
+            size = len(self.categories[col])
+            blocks.append(sparse.csr_matrix(
+                (np.ones(known.sum(), dtype=np.float32),
+                 (np.nonzero(known)[0], codes[known])),
+                shape=(len(df), size)))
+            names.extend('{}_{}'.format(col, v)
+                         for v in self.categories[col])
+        return sparse.hstack(blocks, format='csr'), names
+
+    def hashed(self, df, columns=None, n_features=HASH_FEATURES):
+        """ Sparse matrix with each column=value pair hashed into one of
+        n_features columns. Only the unique values in the batch are
+        hashed and it does not need the vocabulary, so unseen values are
+        encoded too
+        """
+        columns = self.columns if columns is None else columns
+        rows, cols = [], []
+        for col in columns:
+            codes, uniques = factorize(df[col])
+            keys = np.array(['{}={}'.format(col, u) for u in uniques],
+                            dtype=object)
+            buckets = (pd.util.hash_array(keys) % n_features).astype(np.int64)
+            known = np.nonzero(codes >= 0)[0]
+            rows.append(known)
+            cols.append(buckets[codes[known]])
+        rows = np.concatenate(rows)
+        cols = np.concatenate(cols)
+        # Duplicate entries from hash collisions are added together
+        return sparse.csr_matrix(
+            (np.ones(len(rows), dtype=np.float32), (rows, cols)),
+            shape=(len(df), n_features))
+
+    def transform(self, df, one_hot=None, ordinal=None, passthrough=None):
+        """ Build a single sparse feature matrix like the notebook's
+        make_column_transformer. Returns the matrix and the feature names
+        """
+        blocks, names = [], []
+        if one_hot:
+            matrix, one_hot_names = self.one_hot(df, one_hot)
+            blocks.append(matrix)
+            names.extend(one_hot_names)
+        if ordinal:
+            blocks.append(sparse.csr_matrix(
+                self.ordinal(df, ordinal).to_numpy(dtype=np.float32)))
+            names.extend(ordinal)
+        if passthrough:
+            blocks.append(sparse.csr_matrix(
+                df[passthrough].to_numpy(dtype=np.float32)))
+            names.extend(passthrough)
+        return sparse.hstack(blocks, format='csr'), names
+
+    def save(self, filename):
+        """ Save the vocabularies to a json file
+        """
+        state = {'columns': self.columns,
+                 'fixed': sorted(self.fixed),
+                 'categories': {col: [v.item() if hasattr(v, 'item') else v
+                                      for v in values]
+                                for col, values in self.categories.items()}}
+        Path(filename).write_text(json.dumps(state, indent=2))
+
+    @classmethod
+    def load(cls, filename):
+        """ Create an encoder from a file written by save
+        """
+        state = json.loads(Path(filename).read_text())
+        encoder = cls(state['columns'])
+        for col, values in state['categories'].items():
+            encoder._set_vocabulary(col, values)
+        encoder.fixed = set(state['fixed'])
+        return encoder
+
+
+def encode_batches(batches, encoder, method='one_hot', columns=None,
+                   update=False, **kwargs):
+    """ Encode an iterable of DataFrames, such as pd.read_csv(chunksize=...),
+    with a fitted encoder. Yields one result per batch. Pass update=True to
+    add new values to the vocabularies as they are seen
+    """
+    for batch in batches:
+        if update:
+            encoder.partial_fit(batch)
+        yield getattr(encoder, method)(batch, columns, **kwargs)
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Encode the categorical columns of the autos data')
+    parser.add_argument('--infile', default=AUTOS_URL)
+    parser.add_argument('--vocab', default='autos_vocab.json',
+                        help='File to save the vocabularies to')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    df = pd.read_csv(args.infile, header=None, names=AUTOS_HEADERS,
+                     na_values="?")
+    encoder = CategoryEncoder(categories={
+        'num_doors': ['two', 'four'],
+        'num_cylinders': ['two', 'three', 'four', 'five', 'six', 'eight',
+                          'twelve']}).fit(df)
+    encoder.save(args.vocab)
+    print(encoder.ordinal(df, ['num_doors', 'num_cylinders', 'make']).head())
+    features, names = encoder.transform(
+        df, one_hot=['fuel_type', 'make', 'drive_wheels'],
+        ordinal=['aspiration'],
+        passthrough=['highway_mpg', 'city_mpg', 'curb_weight'])
+    print("{} features, {} stored values".format(len(names), features.nnz))
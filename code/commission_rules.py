@@ -0,0 +1,241 @@
+"""
+Table driven sales commission and bonus rules.
+
+See http://pbpython.com/excel-filter-edit.html and the Commissions-Example
+notebook for the background.
+
+The notebook applies each rule with its own df.loc[mask, cols] = ...
+statement, so every rule scans the whole sales frame and adding a rule
+means changing the code. Here the rules are rows in a table:
+
+    category        rule applies to this category (blank for all)
+    min_quantity    quantity >= value
+    max_quantity    quantity < value
+    min_ext_price   ext price >= value
+    max_ext_price   ext price < value
+    priority        higher priority rules win, later rows win ties
+    commission      commission rate (blank leaves it to lower rules)
+    bonus           flat bonus (blank leaves it to lower rules)
+
+Blank conditions always match. The table is compiled once into a list of
+conditions sorted by priority and both the commission and bonus are found
+with np.select over the same conditions. Conditions that are shared by
+several rules, such as a category test, are only evaluated once.
+"""
+from __future__ import print_function
+import argparse
+import time
+import numpy as np
+import pandas as pd
+from data_loader import load
+from instrument import traced
+
+SALES_FILE = 'sample-sales-reps.xlsx'
+
+RULE_COLUMNS = ['category', 'min_quantity', 'max_quantity', 'min_ext_price',
+                'max_ext_price', 'priority', 'commission', 'bonus']
+# Rule column, sales column and comparison for each condition
+CONDITIONS = [('min_quantity', 'quantity', np.greater_equal),
+              ('max_quantity', 'quantity', np.less),
+              ('min_ext_price', 'ext price', np.greater_equal),
+              ('max_ext_price', 'ext price', np.less)]
+
+# The rules from the notebook
+DEFAULT_RULES = pd.DataFrame([
+    {'priority': 0, 'commission': .02, 'bonus': 0},
+    {'category': 'Shirt', 'priority': 1, 'commission': .025},
+    {'category': 'Belt', 'min_quantity': 10, 'priority': 2,
+     'commission': .04},
+    {'category': 'Shoes', 'min_ext_price': 1000, 'priority': 3,
+     'commission': .045, 'bonus': 250},
+], columns=RULE_COLUMNS)
+
+# Number of sales rows evaluated at one time
+CHUNK_SIZE = 250_000
+
+
+def load_rules(rule_file):
+    """ Read a rule table from a csv or Excel file
+    """
+    if str(rule_file).endswith('.csv'):
+        return pd.read_csv(rule_file)
+    return pd.read_excel(rule_file)
+
+
+class RuleEngine(object):
+    """ A compiled rule table that can be applied to any sales frame
+    """
+
+    def __init__(self, rules=DEFAULT_RULES, chunk_size=CHUNK_SIZE):
+        unknown = set(rules.columns) - set(RULE_COLUMNS)
+        if unknown:
+            raise ValueError("Unknown rule columns: {}".format(
+                ", ".join(sorted(unknown))))
+        rules = rules.reindex(columns=RULE_COLUMNS)
+        rules['priority'] = rules['priority'].fillna(0)
+        # np.select uses the first match so sort from the highest priority.
+        # A stable sort of the reversed table lets later rows win ties
+        rules = rules.iloc[::-1].sort_values('priority', ascending=False,
+                                             kind='stable')
+        self.rules = rules.reset_index(drop=True)
+        self.chunk_size = chunk_size
+        self.categories = pd.Index(rules['category'].dropna().unique())
+        self.category_codes = self.categories.get_indexer(rules['category'])
+
+    def conditions(self, codes, columns):
+        """ Return a boolean array for every rule. Each distinct test is
+        only evaluated once
+        """
+        cache = {}
+        size = len(codes)
+
+        def test(key, func, values, limit):
+            if key not in cache:
+                cache[key] = func(values, limit)
+            return cache[key]
+
+        result = []
+        for i, rule in enumerate(self.rules.itertuples(index=False)):
+            parts = []
+            if self.category_codes[i] >= 0:
+                parts.append(test(('category', self.category_codes[i]),
+                                  np.equal, codes, self.category_codes[i]))
+            for rule_col, sales_col, func in CONDITIONS:
+                limit = getattr(rule, rule_col)
+                if pd.notna(limit):
+                    parts.append(test((rule_col, limit), func,
+                                      columns[sales_col], limit))
+            if not parts:
+                parts.append(test('all', lambda v, _: np.ones(size, bool),
+                                  None, None))
+            cond = parts[0]
+            for part in parts[1:]:
+                cond = cond & part
+            result.append(cond)
+        return result
+
+    @traced()
+    def evaluate(self, df):
+        """ Return the commission rate and bonus for every sale
+        """
+        codes = self.categories.get_indexer(df['category'])
+        quantity = df['quantity'].to_numpy()
+        ext_price = df['ext price'].to_numpy()
+        commission = np.zeros(len(df))
+        bonus = np.zeros(len(df))
+        has_commission = self.rules['commission'].notna().to_numpy()
+        has_bonus = self.rules['bonus'].notna().to_numpy()
+        commission_values = self.rules['commission'][has_commission].tolist()
+        bonus_values = self.rules['bonus'][has_bonus].tolist()
+        for start in range(0, len(df), self.chunk_size):
+            chunk = slice(start, start + self.chunk_size)
+            conds = self.conditions(codes[chunk],
+                                    {'quantity': quantity[chunk],
+                                     'ext price': ext_price[chunk]})
+            commission[chunk] = np.select(
+                [c for c, keep in zip(conds, has_commission) if keep],
+                commission_values, 0)
+            bonus[chunk] = np.select(
+                [c for c, keep in zip(conds, has_bonus) if keep],
+                bonus_values, 0)
+        return commission, bonus
+
+    def apply(self, df):
+        """ Return a copy of the sales with commission, bonus and comp
+        columns like the notebook
+        """
+        df = df.copy()
+        df['commission'], df['bonus'] = self.evaluate(df)
+        df['comp'] = df['commission'] * df['ext price'] + df['bonus']
+        return df
+
+
+@traced()
+def rep_totals(df, rules=DEFAULT_RULES):
+    """ Total compensation for each sales rep
+    """
+    comp = RuleEngine(rules).apply(df)
+    return comp.groupby(['sales rep'])['comp'].sum().round(2)
+
+
+def random_sales(num_rows, num_categories=20, num_reps=50, seed=0):
+    """ Sales transactions with the same columns the rules use
+    """
+    rng = np.random.default_rng(seed)
+    categories = np.array(['Category {}'.format(i)
+                           for i in range(num_categories)])
+    reps = np.array(['Rep {}'.format(i) for i in range(num_reps)])
+    quantity = rng.integers(1, 20, num_rows)
+    unit_price = rng.uniform(10, 100, num_rows).round(2)
+    return pd.DataFrame({
+        'sales rep': pd.Categorical.from_codes(
+            rng.integers(0, num_reps, num_rows), reps),
+        'category': pd.Categorical.from_codes(
+            rng.integers(0, num_categories, num_rows), categories),
+        'quantity': quantity,
+        'ext price': quantity * unit_price})
+
+
+def random_rules(num_rules, num_categories=20, seed=0):
+    """ A rule table with a default rule plus random category, quantity
+    and price tiers
+    """
+    rng = np.random.default_rng(seed)
+    n = num_rules - 1
+    rules = pd.DataFrame({
+        'category': ['Category {}'.format(i)
+                     for i in rng.integers(0, num_categories, n)],
+        'min_quantity': np.where(rng.random(n) < .5,
+                                 rng.integers(2, 15, n), np.nan),
+        'min_ext_price': np.where(rng.random(n) < .5,
+                                  rng.integers(1, 15, n) * 100, np.nan),
+        'priority': rng.integers(1, 10, n),
+        'commission': rng.uniform(.02, .06, n).round(3),
+        'bonus': np.where(rng.random(n) < .2, 250, np.nan)})
+    default = pd.DataFrame([{'priority': 0, 'commission': .02, 'bonus': 0}])
+    return pd.concat([default, rules], ignore_index=True)
+
+
+def benchmark(row_counts, rule_counts, chunk_size=CHUNK_SIZE):
+    """ Time the engine for each combination of sales rows and rules
+    """
+    results = []
+    for num_rows in row_counts:
+        sales = random_sales(num_rows)
+        for num_rules in rule_counts:
+            engine = RuleEngine(random_rules(num_rules), chunk_size)
+            start = time.perf_counter()
+            engine.evaluate(sales)
+            elapsed = time.perf_counter() - start
+            results.append({'rows': num_rows,
+                            'rules': num_rules,
+                            'seconds': elapsed,
+                            'rows_per_second': num_rows / elapsed})
+    return pd.DataFrame(results)
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Calculate sales commissions from a rule table')
+    parser.add_argument('--infile', default=SALES_FILE,
+                        help='Excel file with the sales transactions')
+    parser.add_argument('--rules', help='csv or Excel file with the rules')
+    parser.add_argument('--benchmark', action='store_true',
+                        help='Time the engine on random data')
+    parser.add_argument('--rows', type=int, nargs='+',
+                        default=[1_000_000, 10_000_000])
+    parser.add_argument('--num-rules', type=int, nargs='+',
+                        default=[4, 50, 200, 500])
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.benchmark:
+        print(benchmark(args.rows, args.num_rules).to_string(index=False))
+    else:
+        rules = DEFAULT_RULES if args.rules is None else load_rules(args.rules)
+        sales = load(args.infile)
+        print(rep_totals(sales, rules))
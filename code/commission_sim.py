@@ -0,0 +1,244 @@
+"""
+Monte Carlo simulation of the sales commission budget.
+
+See https://pbpython.com/monte-carlo.html and the Monte_Carlo_Simulationv2
+notebook for the background on the model.
+
+The notebook creates the full (num_reps, num_simulations) arrays in memory
+which does not scale to thousands of reps and millions of trials. This
+version splits the simulations into fixed size blocks. Each block gets its
+own random Generator spawned from a single SeedSequence and is processed in
+a worker process in small float32 chunks. Every block is reduced to a
+running mean, variance, min, max and a fine grained histogram which is used
+for the quantiles. Memory use is constant and the results are the same no
+matter how many workers are used.
+
+The model itself, including the commission rates, is unchanged from the
+notebook.
+"""
+from __future__ import print_function
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import numpy as np
+import pandas as pd
+
+# Percent to target based on historical results
+AVG = 1
+STD_DEV = .1
+
+# Sales target distribution
+SALES_TARGET_VALUES = [75_000, 100_000, 200_000, 300_000, 400_000, 500_000]
+SALES_TARGET_PROB = [.3, .3, .2, .1, .05, .05]
+
+# Commission rate based on the percent to target, the same as the notebook's
+# np.take([0.02, 0.03, 0.04], np.digitize(pct_to_target, [.9, .99, 10])):
+# 2% below 90% of target, 3% up to 99% and 4% at or above 99%
+COMMISSION_BINS = [.9, .99, 10]
+COMMISSION_RATES = [0.02, 0.03, 0.04]
+
+# Number of trials handled by one task in the process pool
+BLOCK_SIZE = 50_000
+# Maximum number of float32 values to hold at one time in a block
+CHUNK_ELEMENTS = 4_000_000
+# Number of histogram bins used to estimate the quantiles
+SKETCH_BINS = 100_000
+
+
+class SimulationStats(object):
+    """ Running statistics for the total commissions of each trial.
+    Two sets of statistics can be merged so blocks can be reduced in any
+    process and combined at the end.
+    """
+
+    def __init__(self, edges):
+        self.edges = edges
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = np.inf
+        self.max = -np.inf
+        self.counts = np.zeros(len(edges) - 1, dtype=np.int64)
+
+    def update(self, values):
+        """ Add an array of trial results to the statistics
+        """
+        other = SimulationStats(self.edges)
+        other.count = len(values)
+        other.mean = values.mean()
+        other.m2 = ((values - other.mean)**2).sum()
+        other.min = values.min()
+        other.max = values.max()
+        idx = np.searchsorted(self.edges, values, side='right') - 1
+        idx = np.clip(idx, 0, len(other.counts) - 1)
+        other.counts = np.bincount(idx, minlength=len(other.counts))
+        self.merge(other)
+
+    def merge(self, other):
+        """ Combine the statistics from another block using the parallel
+        variance algorithm from Chan et al.
+        """
+        if other.count == 0:
+            return self
+        total = self.count + other.count
+        delta = other.mean - self.mean
+        self.mean += delta * other.count / total
+        self.m2 += other.m2 + delta**2 * self.count * other.count / total
+        self.count = total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+        self.counts += other.counts
+        return self
+
+    @property
+    def std(self):
+        """ Sample standard deviation to match numpy and pandas defaults
+        """
+        return np.sqrt(self.m2 / (self.count - 1))
+
+    @property
+    def quantile_error(self):
+        """ Largest possible error of a quantile estimate (one bin width)
+        """
+        return self.edges[1] - self.edges[0]
+
+    def quantile(self, q):
+        """ Estimate the quantile from the histogram by interpolating
+        within the bin that contains it
+        """
+        cum = np.cumsum(self.counts)
+        target = q * self.count
+        idx = min(np.searchsorted(cum, target), len(cum) - 1)
+        prev = cum[idx - 1] if idx > 0 else 0
+        fraction = (target - prev) / max(self.counts[idx], 1)
+        value = self.edges[idx] + fraction * self.quantile_error
+        return float(np.clip(value, self.min, self.max))
+
+    def histogram(self, bins=50):
+        """ Re-bin the fine histogram over the observed range.
+        Returns the counts and bin edges like np.histogram
+        """
+        used = np.nonzero(self.counts)[0]
+        counts = self.counts[used[0]:used[-1] + 1]
+        edges = self.edges[used[0]:used[-1] + 2]
+        groups = np.array_split(np.arange(len(counts)), min(bins, len(counts)))
+        new_counts = np.array([counts[g].sum() for g in groups])
+        new_edges = np.array([edges[g[0]] for g in groups] + [edges[-1]])
+        return new_counts, new_edges
+
+    def describe(self):
+        """ Summary in the same format as DataFrame.describe()
+        """
+        return pd.Series({'count': self.count,
+                          'mean': self.mean,
+                          'std': self.std,
+                          'min': self.min,
+                          '25%': self.quantile(.25),
+                          '50%': self.quantile(.5),
+                          '75%': self.quantile(.75),
+                          'max': self.max}, name='Total_Commissions')
+
+
+def total_range(num_reps):
+    """ The smallest and largest total commission that is possible
+    """
+    low = num_reps * min(SALES_TARGET_VALUES) * min(COMMISSION_RATES)
+    high = num_reps * max(SALES_TARGET_VALUES) * max(COMMISSION_RATES)
+    return low, high
+
+
+def simulate_block(seed, num_reps, size, edges):
+    """ Run one block of trials and return the SimulationStats for it.
+    The reps are processed a chunk at a time using float32 buffers that are
+    updated in place.
+    """
+    rng = np.random.default_rng(seed)
+    target_values = np.array(SALES_TARGET_VALUES, dtype=np.float32)
+    target_cdf = np.cumsum(SALES_TARGET_PROB).astype(np.float32)
+    rates = np.array(COMMISSION_RATES, dtype=np.float32)
+    bins = np.array(COMMISSION_BINS, dtype=np.float32)
+
+    rep_chunk = max(1, min(num_reps, CHUNK_ELEMENTS // size))
+    pct = np.empty((rep_chunk, size), dtype=np.float32)
+    target = np.empty((rep_chunk, size), dtype=np.float32)
+    totals = np.zeros(size, dtype=np.float64)
+
+    for start in range(0, num_reps, rep_chunk):
+        rows = min(rep_chunk, num_reps - start)
+        pct_chunk = pct[:rows]
+        target_chunk = target[:rows]
+        # Percent to target
+        rng.standard_normal(dtype=np.float32, out=pct_chunk)
+        pct_chunk *= STD_DEV
+        pct_chunk += AVG
+        # Sales target drawn using the cumulative probabilities
+        rng.random(dtype=np.float32, out=target_chunk)
+        idx = np.searchsorted(target_cdf, target_chunk, side='right')
+        np.take(target_values, idx, out=target_chunk, mode='clip')
+        # Same as np.digitize(pct, bins) to look up the commission rate
+        idx = np.searchsorted(bins, pct_chunk, side='right')
+        np.take(rates, idx, out=pct_chunk, mode='clip')
+        pct_chunk *= target_chunk
+        totals += pct_chunk.sum(axis=0, dtype=np.float64)
+
+    stats = SimulationStats(edges)
+    stats.update(totals)
+    return stats
+
+
+def _simulate_block(args):
+    """ Unpack the arguments for use with the process pool
+    """
+    return simulate_block(*args)
+
+
+def run_simulation(num_reps=500, num_simulations=100_000, seed=None,
+                   workers=None, block_size=BLOCK_SIZE):
+    """ Run all of the simulations and return the combined SimulationStats.
+    The same seed gives the same results for any number of workers
+    """
+    low, high = total_range(num_reps)
+    edges = np.linspace(low, high, SKETCH_BINS + 1)
+    sizes = [min(block_size, num_simulations - start)
+             for start in range(0, num_simulations, block_size)]
+    seeds = np.random.SeedSequence(seed).spawn(len(sizes))
+    tasks = [(s, num_reps, size, edges) for s, size in zip(seeds, sizes)]
+
+    stats = SimulationStats(edges)
+    if workers == 1:
+        results = map(_simulate_block, tasks)
+        for block in results:
+            stats.merge(block)
+    else:
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            # map returns the blocks in order so the merge is deterministic
+            for block in executor.map(_simulate_block, tasks):
+                stats.merge(block)
+    return stats
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Monte Carlo simulation of the commission budget')
+    parser.add_argument('--reps', type=int, default=500,
+                        help='Number of sales reps')
+    parser.add_argument('--simulations', type=int, default=100_000,
+                        help='Number of trials to run')
+    parser.add_argument('--seed', type=int, default=None,
+                        help='Seed for reproducible results')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    results = run_simulation(args.reps, args.simulations, args.seed,
+                             args.workers)
+    print(results.describe())
+    print("Quantiles are accurate to +/- {:,.0f}".format(
+        results.quantile_error))
+    counts, edges = results.histogram(bins=20)
+    for count, edge in zip(counts, edges):
+        print("{:>14,.0f} {}".format(edge, "#" * int(60 * count / counts.max())))
@@ -4,6 +4,8 @@ Requires https://python-pptx.readthedocs.org/en/latest/index.html
 
 Example program showing how to read in Excel, process with pandas and
 output to a PowerPoint file.
+
+Set PBP_TRACE=1 to see how long each stage takes, see instrument.py
 """
 
 from __future__ import print_function
@@ -15,8 +17,10 @@ import numpy as np
 from datetime import date
 import matplotlib.pyplot as plt
 import seaborn as sns
+from instrument import span, traced
 
 
+@traced()
 def df_to_table(slide, df, left, top, width, height, colnames=None):
     """Converts a Pandas DataFrame to a PowerPoint table on the given
     Slide of a PowerPoint presentation.
@@ -42,7 +46,7 @@ def df_to_table(slide, df, left, top, width, height, colnames=None):
             col_name = " ".join(col_name)
         res.table.cell(0, col_index).text = col_name
 
-    m = df.as_matrix()
+    m = df.to_numpy()
 
     for row in range(rows):
         for col in range(cols):
@@ -68,6 +72,7 @@ def parse_args():
     return parser.parse_args()
 
 
+@traced()
 def create_pivot(df, index_list=["Manager", "Rep", "Product"],
                  value_list=["Price", "Quantity"]):
     """
@@ -80,17 +85,20 @@ def create_pivot(df, index_list=["Manager", "Rep", "Product"],
     return table
 
 
+@traced()
 def create_chart(df, filename):
     """ Create a simple bar chart saved to the filename based on the dataframe
     passed to the function
     """
     df['total'] = df['Quantity'] * df['Price']
-    final_plot = df.groupby('Name')['total'].sum().order().plot(kind='barh')
+    final_plot = df.groupby('Name')['total'].sum().sort_values().plot(kind='barh')
     fig = final_plot.get_figure()
     fig.set_size_inches(6, 4.5)
-    fig.savefig(filename, bbox_inches='tight', dpi=600)
+    with span('savefig', file=filename):
+        fig.savefig(filename, bbox_inches='tight', dpi=600)
 
 
+@traced()
 def create_ppt(input, output, report_data, chart):
     """ Take the input powerpoint file and use it as the template for the output
     file.
@@ -128,12 +136,15 @@ def create_ppt(input, output, report_data, chart):
         # Create a table on the slide
         df_to_table(slide, report_data.xs(manager, level=0).reset_index(),
                     left, top, width, height)
-    prs.save(output)
+    with span('save', file=output):
+        prs.save(output)
 
 
 if __name__ == "__main__":
     args = parse_args()
-    df = pd.read_excel(args.report.name)
+    with span('read_excel', file=args.report.name) as s:
+        df = pd.read_excel(args.report.name)
+        s.rows_out = len(df)
     report_data = create_pivot(df)
     create_chart(df, "report-image.png")
     create_ppt(args.infile.name, args.outfile.name, report_data, "report-image.png")
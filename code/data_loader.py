@@ -0,0 +1,195 @@
+"""
+Load the sample files in the data directory through a parquet cache.
+
+Many of the scripts and notebooks read the same Excel files straight from
+GitHub on every run and parsing Excel is the slowest part of all of them.
+load() looks for the file in the local data directory first. The first
+time a file is read the DataFrame is saved as a parquet file in a .cache
+folder next to the source and later reads come from the parquet file.
+
+The size, modification time and sha256 of the source are stored in the
+parquet metadata. If the size or time changes the hash is checked, and the
+file is only parsed again if the contents really changed. Each cache file
+is written to a temporary name and renamed into place, so several
+processes can read and build the cache at the same time without ever
+seeing a partial file.
+
+Usage:
+    from data_loader import load
+    df = load('sample-salesv3.xlsx')
+"""
+from __future__ import print_function
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import tempfile
+from pathlib import Path
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+from instrument import span, traced
+
+DATA_DIR = Path(__file__).resolve().parent.parent / 'data'
+DATA_URL = 'https://github.com/chris1610/pbpython/blob/master/data/'
+CACHE_FOLDER = '.cache'
+# Key used to store the source details in the parquet metadata
+META_KEY = b'pbp_source'
+
+
+def data_path(name, data_dir=DATA_DIR):
+    """ Return the local path for a file name, path or GitHub data URL.
+    The name is returned unchanged if there is no local copy
+    """
+    name = str(name)
+    if name.startswith(DATA_URL):
+        name = name[len(DATA_URL):].split('?')[0]
+    if os.path.exists(name):
+        return Path(name)
+    local = Path(data_dir) / Path(name).name
+    if local.exists():
+        return local
+    return name
+
+
+def file_hash(path, block_size=1 << 20):
+    """ sha256 of a file, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_source(path, **kwargs):
+    """ Parse a csv or Excel file
+    """
+    if Path(path).suffix.lower() in ('.csv', '.txt'):
+        return pd.read_csv(path, **kwargs)
+    return pd.read_excel(path, **kwargs)
+
+
+def cache_path(path, **kwargs):
+    """ The cache file for a source file and set of read arguments
+    """
+    path = Path(path)
+    options = json.dumps(kwargs, sort_keys=True, default=str)
+    key = hashlib.sha256(options.encode()).hexdigest()[:16]
+    return path.parent / CACHE_FOLDER / '{}.{}.parquet'.format(path.name, key)
+
+
+def read_cache(cache_file, source):
+    """ Return the cached DataFrame if it is still current for the source.
+    Returns None if there is no usable cache
+    """
+    try:
+        table = pq.read_table(cache_file)
+    except (OSError, pa.ArrowException):
+        return None
+    meta = json.loads((table.schema.metadata or {}).get(META_KEY, b'{}'))
+    stat = source.stat()
+    if meta.get('size') != stat.st_size:
+        return None
+    if meta.get('mtime_ns') != stat.st_mtime_ns:
+        # Copying or checking out the file changes the time but not always
+        # the contents
+        if meta.get('sha256') != file_hash(source):
+            return None
+        write_cache(table, cache_file, source, meta['sha256'])
+    return table.to_pandas()
+
+
+def write_cache(table, cache_file, source, sha256=None):
+    """ Save a table with the details of the source to the cache.
+    The file is written to a temporary name and renamed into place
+    """
+    stat = source.stat()
+    meta = {'size': stat.st_size,
+            'mtime_ns': stat.st_mtime_ns,
+            'sha256': sha256 or file_hash(source)}
+    metadata = dict(table.schema.metadata or {})
+    metadata[META_KEY] = json.dumps(meta).encode()
+    table = table.replace_schema_metadata(metadata)
+    cache_file.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp_name = tempfile.mkstemp(dir=cache_file.parent, suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            pq.write_table(table, f)
+        os.replace(tmp_name, cache_file)
+    except OSError:
+        # Another process may have the file open on Windows. Their copy is
+        # just as good so leave it
+        if os.path.exists(tmp_name):
+            os.remove(tmp_name)
+
+
+@traced()
+def load(name, refresh=False, data_dir=DATA_DIR, **kwargs):
+    """ Read a csv or Excel file, using the cache for local files.
+
+    Args:
+        name = file name in the data directory, a path or a GitHub data URL
+        refresh = parse the source again even if the cache is current
+        data_dir = directory to look in for local copies
+        kwargs = passed to pd.read_excel or pd.read_csv
+    Returns:
+        DataFrame
+    """
+    source = data_path(name, data_dir)
+    if not isinstance(source, Path):
+        # Not available locally so read it directly
+        with span('read_source', file=source):
+            return read_source(source, **kwargs)
+    cache_file = cache_path(source, **kwargs)
+    if not refresh:
+        with span('read_cache', file=source.name):
+            df = read_cache(cache_file, source)
+        if df is not None:
+            return df
+    sha256 = file_hash(source)
+    with span('read_source', file=source.name):
+        df = read_source(source, **kwargs)
+    if not isinstance(df, pd.DataFrame):
+        # A dictionary of sheets from sheet_name=None is not cached
+        return df
+    try:
+        table = pa.Table.from_pandas(df)
+    except (pa.ArrowInvalid, pa.ArrowTypeError):
+        # Columns with mixed types can not be saved as parquet
+        return df
+    with span('write_cache', file=source.name):
+        write_cache(table, cache_file, source, sha256)
+    return df
+
+
+def clear_cache(data_dir=DATA_DIR):
+    """ Remove all of the cached files
+    """
+    shutil.rmtree(Path(data_dir) / CACHE_FOLDER, ignore_errors=True)
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Build or clear the cache for the data files')
+    parser.add_argument('names', nargs='*',
+                        help='Files to cache, defaults to all of data/')
+    parser.add_argument('--clear', action='store_true',
+                        help='Remove the cache')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.clear:
+        clear_cache()
+    else:
+        names = args.names or sorted(
+            p.name for p in DATA_DIR.iterdir()
+            if p.suffix.lower() in ('.csv', '.xlsx', '.xls'))
+        for name in names:
+            df = load(name)
+            print("{}: {} rows".format(name, len(df)))
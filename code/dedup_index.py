@@ -0,0 +1,349 @@
+"""
+Persistent duplicate detection index for a growing account master.
+
+See https://pbpython.com/record-linking.html for the dedupe example this
+builds on. The recordlinkage version compares every candidate pair from
+scratch on each run. This index stores a MinHash signature of the
+normalized name and the address for every record in a sqlite database, along
+with the locality sensitive hashing (LSH) buckets for the signature and the
+cluster each record belongs to.
+
+New records are upserted in batches. Each new record is only compared with
+the records that share a bucket within the same block (state by default).
+Matches are merged into clusters which are kept on disk between runs.
+"""
+from __future__ import print_function
+import argparse
+import sqlite3
+import zlib
+import numpy as np
+import pandas as pd
+
+# MinHash settings. The first half of the signature is for the name and
+# the second half for the address. NUM_PERM = BANDS * ROWS
+NUM_PERM = 64
+HALF = NUM_PERM // 2
+BANDS = 16
+ROWS = 4
+SHINGLE_SIZE = 3
+# Mersenne prime used for the hash permutations
+PRIME = (1 << 31) - 1
+SEED = 1610
+
+# Two records are duplicates when the estimated Jaccard similarity of both
+# the name and the address are at least MATCH_THRESHOLD. If the phone
+# numbers match the address only needs to be at least PHONE_THRESHOLD
+MATCH_THRESHOLD = 0.7
+PHONE_THRESHOLD = 0.5
+
+# Common variations to clean up before building the signature
+REPLACEMENTS = {
+    "SAINT": "ST",
+    "STREET": "ST",
+    "AVENUE": "AVE",
+    "ROAD": "RD",
+    "DRIVE": "DR",
+    "BOULEVARD": "BLVD",
+    "HIGHWAY": "HWY",
+    "NORTH": "N",
+    "SOUTH": "S",
+    "EAST": "E",
+    "WEST": "W",
+    "CENTER": "CTR",
+    "MEDICAL": "MED",
+    "HOSPITAL": "HOSP",
+}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS records (
+    record_id TEXT PRIMARY KEY,
+    block TEXT,
+    phone TEXT,
+    signature BLOB,
+    cluster_id TEXT
+);
+CREATE TABLE IF NOT EXISTS buckets (
+    block TEXT,
+    band INTEGER,
+    bucket INTEGER,
+    record_id TEXT
+);
+CREATE INDEX IF NOT EXISTS bucket_idx ON buckets (block, band, bucket);
+CREATE INDEX IF NOT EXISTS bucket_record_idx ON buckets (record_id);
+CREATE INDEX IF NOT EXISTS cluster_idx ON records (cluster_id);
+"""
+
+
+def normalize(series):
+    """ Upper case, remove punctuation and standardize common words
+    """
+    text = series.fillna("").astype(str).str.upper()
+    text = text.str.replace(r"[^A-Z0-9 ]", " ", regex=True)
+    pattern = r"\b({})\b".format("|".join(REPLACEMENTS))
+    text = text.str.replace(pattern, lambda m: REPLACEMENTS[m.group(1)],
+                            regex=True)
+    return text.str.replace(r"\s+", " ", regex=True).str.strip()
+
+
+def permutations(num_perm=NUM_PERM, seed=SEED):
+    """ The a and b values for the universal hash functions.
+    These must stay the same for the life of the index
+    """
+    rng = np.random.RandomState(seed)
+    a = rng.randint(1, PRIME, size=num_perm).astype(np.uint64)
+    b = rng.randint(0, PRIME, size=num_perm).astype(np.uint64)
+    return a, b
+
+
+PERM_A, PERM_B = permutations()
+
+
+def minhash(text, num_perm=NUM_PERM):
+    """ Return the MinHash signature for a string as a uint32 array
+    """
+    padded = " {} ".format(text)
+    shingles = {padded[i:i + SHINGLE_SIZE]
+                for i in range(max(len(padded) - SHINGLE_SIZE + 1, 1))}
+    hashes = np.array([zlib.crc32(s.encode("utf-8")) for s in shingles],
+                      dtype=np.uint64)
+    a = PERM_A[:num_perm, None]
+    b = PERM_B[:num_perm, None]
+    values = (a * hashes[None, :] + b) % PRIME
+    return values.min(axis=1).astype(np.uint32)
+
+
+def band_buckets(signatures):
+    """ Hash each band of the signatures into a bucket number.
+    Returns an int64 array of shape (records, BANDS)
+    """
+    bands = signatures.reshape(len(signatures), BANDS, ROWS).astype(np.uint64)
+    # Combine the rows of a band with a simple polynomial hash that wraps
+    multipliers = np.uint64(1000003) ** np.arange(ROWS, dtype=np.uint64)
+    return (bands * multipliers).sum(axis=2).view(np.int64)
+
+
+def similarity(sig_a, sig_b):
+    """ Estimated Jaccard similarity of the names and of the addresses for
+    rows of two signature arrays
+    """
+    same = sig_a == sig_b
+    return same[:, :HALF].mean(axis=1), same[:, HALF:].mean(axis=1)
+
+
+class DedupIndex(object):
+    """ Duplicate detection index stored in a sqlite database.
+
+    Args:
+        db_file = sqlite database file, created if it does not exist
+        id_col, name_col, address_col, block_col, phone_col = column names
+            in the DataFrames passed to upsert and query
+    """
+
+    def __init__(self, db_file, id_col="Account_Num", name_col="Facility Name",
+                 address_col="Address", block_col="State",
+                 phone_col="Phone Number"):
+        self.conn = sqlite3.connect(db_file)
+        self.conn.executescript(SCHEMA)
+        self.id_col = id_col
+        self.name_col = name_col
+        self.address_col = address_col
+        self.block_col = block_col
+        self.phone_col = phone_col
+
+    def close(self):
+        self.conn.close()
+
+    def _prepare(self, df):
+        """ Build the normalized fields, signatures and buckets for a batch
+        """
+        batch = pd.DataFrame({
+            "record_id": df[self.id_col].astype(str).values,
+            "block": normalize(df[self.block_col]).values,
+            "phone": df[self.phone_col].fillna("").astype(str).str.replace(
+                r"\D", "", regex=True).values,
+        })
+        names = normalize(df[self.name_col])
+        addresses = normalize(df[self.address_col])
+        signatures = np.stack([
+            np.concatenate([minhash(n, HALF), minhash(a, HALF)])
+            for n, a in zip(names, addresses)])
+        batch = batch.drop_duplicates("record_id", keep="last")
+        signatures = signatures[batch.index.values]
+        batch = batch.reset_index(drop=True)
+        buckets = band_buckets(signatures)
+        bucket_df = pd.DataFrame({
+            "block": np.repeat(batch["block"].values, BANDS),
+            "band": np.tile(np.arange(BANDS), len(batch)),
+            "bucket": buckets.ravel(),
+            "record_id": np.repeat(batch["record_id"].values, BANDS),
+        })
+        return batch, signatures, bucket_df
+
+    def _stored_candidates(self, bucket_df):
+        """ Pairs of (new record, stored record) that share a bucket
+        """
+        bucket_df.to_sql("new_buckets", self.conn, if_exists="replace",
+                         index=False)
+        pairs = pd.read_sql(
+            """SELECT DISTINCT n.record_id AS new_id, b.record_id AS old_id
+               FROM new_buckets n JOIN buckets b
+               ON n.block = b.block AND n.band = b.band AND n.bucket = b.bucket
+               WHERE n.record_id != b.record_id""", self.conn)
+        self.conn.execute("DROP TABLE new_buckets")
+        return pairs
+
+    def _stored_records(self, record_ids):
+        """ Load the stored fields for a list of record ids
+        """
+        pd.DataFrame({"record_id": record_ids}).to_sql(
+            "lookup_ids", self.conn, if_exists="replace", index=False)
+        stored = pd.read_sql(
+            """SELECT r.record_id, r.phone, r.signature, r.cluster_id
+               FROM records r JOIN lookup_ids l ON r.record_id = l.record_id""",
+            self.conn)
+        self.conn.execute("DROP TABLE lookup_ids")
+        return stored
+
+    def _score(self, batch, signatures, bucket_df):
+        """ Find and score all candidate pairs for a batch.
+        Returns a DataFrame of new_id, old_id, score, duplicate and the
+        stored records for the candidates
+        """
+        stored_pairs = self._stored_candidates(bucket_df)
+        # Pairs inside the batch that share a bucket
+        inner = bucket_df.merge(bucket_df, on=["block", "band", "bucket"])
+        inner = inner[inner["record_id_x"] < inner["record_id_y"]]
+        inner_pairs = inner[["record_id_x", "record_id_y"]].drop_duplicates()
+        inner_pairs.columns = ["new_id", "old_id"]
+
+        stored = self._stored_records(stored_pairs["old_id"].unique().tolist())
+        stored_sigs = np.array(
+            [np.frombuffer(s, dtype=np.uint32) for s in stored["signature"]]
+        ).reshape(len(stored), NUM_PERM)
+
+        new_pos = pd.Series(np.arange(len(batch)), index=batch["record_id"])
+        old_pos = pd.Series(np.arange(len(stored)), index=stored["record_id"])
+        new_phone = batch["phone"].values
+        old_phone = stored["phone"].values
+
+        a = new_pos[stored_pairs["new_id"]].values
+        b = old_pos[stored_pairs["old_id"]].values
+        stored_pairs["name_score"], stored_pairs["address_score"] = (
+            similarity(signatures[a], stored_sigs[b]))
+        stored_pairs["same_phone"] = (new_phone[a] == old_phone[b]) & (
+            new_phone[a] != "")
+
+        a = new_pos[inner_pairs["new_id"]].values
+        b = new_pos[inner_pairs["old_id"]].values
+        inner_pairs["name_score"], inner_pairs["address_score"] = (
+            similarity(signatures[a], signatures[b]))
+        inner_pairs["same_phone"] = (new_phone[a] == new_phone[b]) & (
+            new_phone[a] != "")
+
+        pairs = pd.concat([stored_pairs, inner_pairs], ignore_index=True)
+        pairs["score"] = (pairs["name_score"] + pairs["address_score"]) / 2
+        pairs["duplicate"] = (
+            (pairs["address_score"] >= MATCH_THRESHOLD)
+            & (pairs["name_score"] >= MATCH_THRESHOLD)) | (
+                pairs["same_phone"]
+                & (pairs["address_score"] >= PHONE_THRESHOLD))
+        return pairs, stored
+
+    def query(self, df):
+        """ Return the candidate pairs and scores for the records in df
+        without changing the index
+        """
+        batch, signatures, bucket_df = self._prepare(df)
+        pairs, _ = self._score(batch, signatures, bucket_df)
+        return pairs.sort_values("score", ascending=False).reset_index(
+            drop=True)
+
+    def upsert(self, df):
+        """ Add or replace the records in df and update the clusters.
+        Returns the duplicate pairs that were found
+        """
+        batch, signatures, bucket_df = self._prepare(df)
+        pairs, stored = self._score(batch, signatures, bucket_df)
+        dupes = pairs[pairs["duplicate"]]
+
+        # Union find over the new records and the clusters they touch
+        parent = {}
+
+        def find(x):
+            while parent.setdefault(x, x) != x:
+                parent[x] = parent[parent[x]]
+                x = parent[x]
+            return x
+
+        def union(x, y):
+            rx, ry = find(x), find(y)
+            if rx != ry:
+                # Keep the smallest id as the cluster id
+                parent[max(rx, ry)] = min(rx, ry)
+
+        old_cluster = dict(zip(stored["record_id"], stored["cluster_id"]))
+        for rid in batch["record_id"]:
+            find(rid)
+        for new_id, old_id in zip(dupes["new_id"], dupes["old_id"]):
+            union(new_id, old_cluster.get(old_id, old_id))
+        new_cluster = {rid: find(rid) for rid in batch["record_id"]}
+        # Existing clusters that were joined by the new records
+        merged = {c: find(c) for c in set(old_cluster.values())
+                  if c in parent and find(c) != c}
+
+        with self.conn:
+            ids = [(rid, ) for rid in batch["record_id"]]
+            self.conn.executemany("DELETE FROM buckets WHERE record_id = ?",
+                                  ids)
+            self.conn.executemany(
+                "INSERT OR REPLACE INTO records VALUES (?, ?, ?, ?, ?)",
+                [(rid, block, phone, sig.tobytes(), new_cluster[rid])
+                 for rid, block, phone, sig in zip(batch["record_id"],
+                                                   batch["block"],
+                                                   batch["phone"],
+                                                   signatures)])
+            self.conn.executemany(
+                "INSERT INTO buckets VALUES (?, ?, ?, ?)",
+                bucket_df[["block", "band", "bucket", "record_id"]]
+                .astype(object).itertuples(index=False, name=None))
+            self.conn.executemany(
+                "UPDATE records SET cluster_id = ? WHERE cluster_id = ?",
+                [(new, old) for old, new in merged.items()])
+        return dupes.reset_index(drop=True)
+
+    def clusters(self, min_size=2):
+        """ Return the record ids and cluster ids for every cluster that has
+        at least min_size records
+        """
+        return pd.read_sql(
+            """SELECT record_id, cluster_id FROM records WHERE cluster_id IN
+               (SELECT cluster_id FROM records GROUP BY cluster_id
+                HAVING COUNT(*) >= ?)
+               ORDER BY cluster_id, record_id""",
+            self.conn, params=(min_size, ))
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Add account records to the duplicate index')
+    parser.add_argument('infile', help='csv file of account records')
+    parser.add_argument('--db', default='dedup_index.db',
+                        help='sqlite file for the index')
+    parser.add_argument('--batch-size', type=int, default=5000,
+                        help='Number of records to add at one time')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    accounts = pd.read_csv(args.infile)
+    index = DedupIndex(args.db)
+    for start in range(0, len(accounts), args.batch_size):
+        batch = accounts.iloc[start:start + args.batch_size]
+        dupes = index.upsert(batch)
+        print("Added {} records, found {} duplicate pairs".format(
+            len(batch), len(dupes)))
+    print(index.clusters().groupby("cluster_id").size().describe())
+    index.close()
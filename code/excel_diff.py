@@ -0,0 +1,157 @@
+"""
+Compare two versions of an Excel (or any tabular) file on a key column.
+
+See https://pbpython.com/excel-diff-pandas-update.html and the
+Excel_Diff_Update notebook for the background.
+
+The notebook finds the changes with drop_duplicates, python sets and a
+groupby/apply that calls a python function for every row of every column.
+Here both versions are aligned on the key with one join and each column is
+compared as a whole with NumPy. Rows can optionally be hashed first so
+only the rows whose hash changed are compared column by column.
+"""
+from __future__ import print_function
+import argparse
+from collections import namedtuple
+import numpy as np
+import pandas as pd
+from instrument import span, traced
+
+Diff = namedtuple('Diff', ['added', 'dropped', 'changed', 'cell_changes'])
+
+
+def row_hashes(df, columns):
+    """ Return a uint64 hash for every row of the given columns
+    """
+    return pd.util.hash_pandas_object(df[columns], index=False).to_numpy()
+
+
+def changed_mask(old, new):
+    """ Boolean array that is True where two aligned Series differ.
+    Two missing values are treated as equal
+    """
+    old_na = old.isna().to_numpy()
+    new_na = new.isna().to_numpy()
+    with np.errstate(invalid='ignore'):
+        differs = old.to_numpy() != new.to_numpy()
+    return np.where(old_na | new_na, old_na != new_na, differs)
+
+
+@traced()
+def diff_frames(old, new, key, columns=None, hash_rows=True):
+    """ Compare two DataFrames that share a unique key column.
+
+    Args:
+        old, new = the two versions of the data
+        key = name of the key column
+        columns = columns to compare, defaults to all of the shared columns
+        hash_rows = hash each row first and only compare the rows that changed
+    Returns:
+        Diff namedtuple with
+            added = rows only in new
+            dropped = rows only in old
+            changed = changed rows with each changed cell shown as old ---> new
+            cell_changes = one row per changed cell with the old and new values
+    """
+    if columns is None:
+        columns = [c for c in old.columns if c in new.columns and c != key]
+    for name, df in (('old', old), ('new', new)):
+        if df[key].duplicated().any():
+            raise ValueError("{} data has duplicate values in {}".format(
+                name, key))
+
+    # Align the keys (and optionally the row hashes) with a single join
+    left = pd.DataFrame({key: old[key].to_numpy(),
+                         '_old_pos': np.arange(len(old))})
+    right = pd.DataFrame({key: new[key].to_numpy(),
+                          '_new_pos': np.arange(len(new))})
+    if hash_rows:
+        left['_hash'] = row_hashes(old, columns)
+        right['_hash'] = row_hashes(new, columns)
+    joined = pd.merge(left, right, on=key, how='outer', indicator=True,
+                      suffixes=('_old', '_new'))
+    both = joined[joined['_merge'] == 'both']
+    if hash_rows:
+        both = both[both['_hash_old'] != both['_hash_new']]
+
+    added = new.iloc[joined.loc[joined['_merge'] == 'right_only',
+                                '_new_pos'].astype(int)]
+    dropped = old.iloc[joined.loc[joined['_merge'] == 'left_only',
+                                  '_old_pos'].astype(int)]
+
+    old_rows = old.iloc[both['_old_pos'].astype(int).to_numpy()]
+    new_rows = new.iloc[both['_new_pos'].astype(int).to_numpy()]
+    keys = old_rows[key].to_numpy()
+
+    # Compare a column at a time across all of the candidate rows
+    masks = {c: changed_mask(old_rows[c], new_rows[c]) for c in columns}
+    any_change = np.zeros(len(keys), dtype=bool)
+    for mask in masks.values():
+        any_change |= mask
+
+    changed = {key: keys[any_change]}
+    cells = []
+    for c in columns:
+        mask = masks[c]
+        old_vals = old_rows[c].to_numpy()
+        new_vals = new_rows[c].to_numpy()
+        report = old_vals[any_change].astype(object)
+        rows = mask[any_change]
+        if rows.any():
+            report[rows] = (pd.Series(old_vals[mask]).astype(str) + ' ---> '
+                            + pd.Series(new_vals[mask]).astype(str)).to_numpy()
+        changed[c] = report
+        if mask.any():
+            cells.append(pd.DataFrame({key: keys[mask],
+                                       'column': c,
+                                       'old': old_vals[mask],
+                                       'new': new_vals[mask]}))
+    if cells:
+        cell_changes = pd.concat(cells, ignore_index=True)
+    else:
+        cell_changes = pd.DataFrame(columns=[key, 'column', 'old', 'new'])
+    return Diff(added.reset_index(drop=True), dropped.reset_index(drop=True),
+                pd.DataFrame(changed), cell_changes)
+
+
+@traced()
+def save_diff(diff, output_file, columns=None):
+    """ Save the changed, removed and added rows to separate sheets
+    """
+    with pd.ExcelWriter(output_file) as writer:
+        diff.changed.to_excel(writer, sheet_name='changed', index=False,
+                              columns=columns)
+        diff.dropped.to_excel(writer, sheet_name='removed', index=False,
+                              columns=columns)
+        diff.added.to_excel(writer, sheet_name='added', index=False,
+                            columns=columns)
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(description='Compare two Excel files')
+    parser.add_argument('old', help='Original Excel file')
+    parser.add_argument('new', help='Updated Excel file')
+    parser.add_argument('--key', default='account number',
+                        help='Column that uniquely identifies each row')
+    parser.add_argument('--sheet', default='Sheet1')
+    parser.add_argument('-o', default='my-diff.xlsx', help='Output file')
+    parser.add_argument('--no-hash', action='store_true',
+                        help='Compare every column of every row')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    with span('read_excel', file=args.old) as s:
+        old = pd.read_excel(args.old, args.sheet, na_values=['NA'])
+        s.rows_out = len(old)
+    with span('read_excel', file=args.new) as s:
+        new = pd.read_excel(args.new, args.sheet, na_values=['NA'])
+        s.rows_out = len(new)
+    result = diff_frames(old, new, args.key, hash_rows=not args.no_hash)
+    print("{} added, {} removed, {} changed rows ({} cells)".format(
+        len(result.added), len(result.dropped), len(result.changed),
+        len(result.cell_changes)))
+    save_diff(result, args.o)
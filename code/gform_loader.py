@@ -0,0 +1,218 @@
+"""
+Incrementally pull Google Form responses into a local columnar cache.
+
+panda_gform.py calls get_all_records() which downloads the entire response
+sheet on every run. For large surveys this is slow and uses a lot of memory.
+This module only requests the rows added since the last run, in fixed size
+batches, and appends them to a directory of parquet files. The full
+DataFrame is then read back from the local cache.
+
+Requires pandas with pyarrow (or fastparquet) for the parquet support.
+
+Any object with the same methods as a gspread Worksheet can be used.
+LocalWorksheet is a simple stand-in that can be used to try out the caching
+without a connection to Google.
+"""
+from __future__ import print_function
+import json
+import os
+import pandas as pd
+
+STATE_FILE = "state.json"
+BATCH_SIZE = 5000
+
+
+class LocalWorksheet(object):
+    """ Minimal stand-in for a gspread Worksheet backed by a list of rows.
+    The first row is the header, just like a Google Form response sheet.
+    Only the methods used by load_responses are implemented.
+    """
+
+    def __init__(self, rows, title="Form Responses 1"):
+        self.rows = [list(row) for row in rows]
+        self.title = title
+        self.requests = 0
+
+    @classmethod
+    def from_frame(cls, df, title="Form Responses 1"):
+        """ Build a worksheet from a DataFrame using string cell values
+        """
+        rows = [list(df.columns)] + df.astype(str).values.tolist()
+        return cls(rows, title)
+
+    def append_rows(self, values):
+        """ Add new responses to the bottom of the sheet
+        """
+        self.rows.extend(list(row) for row in values)
+
+    def row_values(self, row):
+        """ Return the values in a row, 1 based like gspread
+        """
+        self.requests += 1
+        if row > len(self.rows):
+            return []
+        return list(self.rows[row - 1])
+
+    def get(self, range_name):
+        """ Return the cell values for an A1 range as a list of lists.
+        Like the Sheets API, rows past the end of the data are not returned.
+        """
+        self.requests += 1
+        start, end = range_name.split(":")
+        first_col, first_row = split_cell(start)
+        last_col, last_row = split_cell(end)
+        return [row[first_col - 1:last_col]
+                for row in self.rows[first_row - 1:last_row]]
+
+
+def col_letter(col):
+    """ Convert a 1 based column number to the Excel style letters
+    1 -> A, 27 -> AA
+    """
+    letters = ""
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        letters = chr(65 + remainder) + letters
+    return letters
+
+
+def split_cell(cell):
+    """ Split an A1 style cell reference into (column number, row number)
+    """
+    letters = cell.rstrip("0123456789")
+    col = 0
+    for letter in letters.upper():
+        col = col * 26 + ord(letter) - 64
+    return col, int(cell[len(letters):])
+
+
+def read_state(cache_dir):
+    """ Return the saved state of the cache or None if it does not exist
+    """
+    state_file = os.path.join(cache_dir, STATE_FILE)
+    if not os.path.isfile(state_file):
+        return None
+    with open(state_file) as data_file:
+        return json.load(data_file)
+
+
+def write_state(cache_dir, state):
+    """ Save the state file in a way that never leaves a partial file behind
+    """
+    state_file = os.path.join(cache_dir, STATE_FILE)
+    tmp_file = "{}.tmp".format(state_file)
+    with open(tmp_file, "w") as data_file:
+        json.dump(state, data_file)
+    os.replace(tmp_file, state_file)
+
+
+def clear_cache(cache_dir):
+    """ Remove all the cached parts and the state file
+    """
+    if not os.path.isdir(cache_dir):
+        return
+    for f in os.listdir(cache_dir):
+        if f.endswith(".parquet") or f == STATE_FILE:
+            os.remove(os.path.join(cache_dir, f))
+
+
+def rows_to_frame(rows, header):
+    """ Convert a block of sheet rows to a DataFrame.
+    The API drops empty trailing cells so short rows are padded out.
+    """
+    width = len(header)
+    padded = [row + [""] * (width - len(row)) for row in rows]
+    return pd.DataFrame(padded, columns=header, dtype=str)
+
+
+def cache_is_valid(worksheet, state):
+    """ Make sure the sheet still starts with the rows that were cached.
+    Compares the header and the last cached row. If rows were deleted or
+    the sheet was sorted the cache needs to be rebuilt.
+    """
+    if worksheet.row_values(1) != state["header"]:
+        return False
+    if state["rows"] == 0:
+        return True
+    last_row = worksheet.row_values(state["rows"] + 1)
+    return last_row == state["last_row"]
+
+
+def update_cache(worksheet, cache_dir, batch_size=BATCH_SIZE):
+    """ Fetch any rows added to the worksheet since the last update and
+    append them to the cache as new parquet parts.
+    Return the number of new rows
+    """
+    if not os.path.isdir(cache_dir):
+        os.makedirs(cache_dir)
+    state = read_state(cache_dir)
+    if state is not None and not cache_is_valid(worksheet, state):
+        print("Cached responses no longer match the sheet. Rebuilding cache")
+        state = None
+    if state is None:
+        clear_cache(cache_dir)
+        header = worksheet.row_values(1)
+        state = {"header": header, "rows": 0, "parts": 0, "last_row": []}
+
+    last_col = col_letter(len(state["header"]))
+    new_rows = 0
+    while True:
+        # Row 1 is the header so data starts on row 2
+        first = state["rows"] + 2
+        last = first + batch_size - 1
+        rows = worksheet.get("A{}:{}{}".format(first, last_col, last))
+        # Skip any completely blank rows at the end of the sheet
+        while rows and not any(rows[-1]):
+            rows.pop()
+        if not rows:
+            break
+        part_file = os.path.join(cache_dir,
+                                 "part-{:05d}.parquet".format(state["parts"]))
+        rows_to_frame(rows, state["header"]).to_parquet(part_file, index=False)
+        state["rows"] += len(rows)
+        state["parts"] += 1
+        state["last_row"] = list(rows[-1])
+        new_rows += len(rows)
+        # Write the state after every part so an interrupted run can resume
+        write_state(cache_dir, state)
+        if len(rows) < batch_size:
+            break
+    if new_rows == 0:
+        write_state(cache_dir, state)
+    return new_rows
+
+
+def read_cache(cache_dir):
+    """ Build the full DataFrame of responses from the cached parts
+    """
+    state = read_state(cache_dir)
+    if state is None or state["rows"] == 0:
+        header = state["header"] if state else []
+        return pd.DataFrame(columns=header, dtype=str)
+    parts = [os.path.join(cache_dir, "part-{:05d}.parquet".format(i))
+             for i in range(state["parts"])]
+    return pd.concat([pd.read_parquet(f) for f in parts], ignore_index=True)
+
+
+def load_responses(worksheet, cache_dir, batch_size=BATCH_SIZE):
+    """ Bring the local cache up to date with the worksheet and return all
+    of the responses as a DataFrame of strings
+    """
+    new_rows = update_cache(worksheet, cache_dir, batch_size)
+    print("Downloaded {} new responses from {}".format(new_rows,
+                                                       worksheet.title))
+    return read_cache(cache_dir)
+
+
+if __name__ == "__main__":
+    import tempfile
+    # Demonstrate the incremental loading using a local stand-in worksheet
+    header = ["Timestamp", "Which OS do you use most frequently?"]
+    responses = [["1/{}/2015 10:00:00".format(i % 28 + 1),
+                  ["Windows", "Mac", "Linux"][i % 3]] for i in range(12000)]
+    sheet = LocalWorksheet([header] + responses[:10000])
+    cache = tempfile.mkdtemp()
+    print(load_responses(sheet, cache).shape)
+    sheet.append_rows(responses[10000:])
+    print(load_responses(sheet, cache).shape)
+    print("Total requests made: {}".format(sheet.requests))
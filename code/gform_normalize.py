@@ -0,0 +1,158 @@
+"""
+Convert the Google Form survey responses into compact, typed columns.
+
+The responses come back from the sheet as strings. Leaving them as python
+objects uses a lot of memory and slows down every groupby. This module uses
+a schema to parse the timestamps with an explicit format, turn the
+frequency questions into ordered categoricals, turn single choice questions
+into categoricals and split the multi-select questions into sparse boolean
+columns.
+
+See http://pbpython.com/pandas-google-forms-part1.html for the survey.
+"""
+from __future__ import print_function
+import numpy as np
+import pandas as pd
+
+# Google Forms stores the response time as 6/9/2015 23:22:43
+TIMESTAMP_FORMAT = "%m/%d/%Y %H:%M:%S"
+
+# Answers to the "How frequently do you use..." questions from low to high
+FREQUENCY_ORDER = ["Never", "Infrequently", "Once a month",
+                   "A couple times a week", "Daily"]
+
+# Column name -> how the column should be stored
+# datetime - parse using the format
+# ordinal - ordered categorical with the listed categories, anything else is NaN
+# category - unordered categorical
+# multi - split the answers on sep into one sparse boolean column per option
+# text - leave as is
+SCHEMA = {
+    'timestamp': {'type': 'datetime', 'format': TIMESTAMP_FORMAT},
+    'version': {'type': 'category'},
+    'useful': {'type': 'ordinal', 'categories': ['1', '2', '3']},
+    'suggestions': {'type': 'text'},
+    'freq-py': {'type': 'ordinal', 'categories': FREQUENCY_ORDER},
+    'freq-sql': {'type': 'ordinal', 'categories': FREQUENCY_ORDER},
+    'freq-r': {'type': 'ordinal', 'categories': FREQUENCY_ORDER},
+    'freq-js': {'type': 'ordinal', 'categories': FREQUENCY_ORDER},
+    'freq-vba': {'type': 'ordinal', 'categories': FREQUENCY_ORDER},
+    'freq-ruby': {'type': 'ordinal', 'categories': FREQUENCY_ORDER},
+    'os': {'type': 'category'},
+    'distro': {'type': 'category'},
+    'notify': {'type': 'multi', 'sep': ', '},
+}
+
+
+def to_ordinal(series, categories):
+    """ Convert the answers to an ordered categorical.
+    The codes are the smallest int type that fits and blanks become NaN
+    """
+    if pd.api.types.is_numeric_dtype(series):
+        # Numeric answers with blanks come in as floats so avoid 1.0 vs 1
+        series = series.astype('Int64')
+    values = series.astype(str)
+    values = values.where(values.isin(categories))
+    return pd.Series(pd.Categorical(values, categories=categories,
+                                    ordered=True),
+                     index=series.index, name=series.name)
+
+
+def to_datetime(series, fmt):
+    """ Parse the timestamps with the explicit format, which is fast.
+    Values in any other format are parsed again the slow way and a
+    ValueError is raised if some still can not be read
+    """
+    result = pd.to_datetime(series, format=fmt, errors='coerce')
+    # Blank answers are allowed to be missing
+    given = series.notna() & (series.astype(str).str.strip() != '')
+    missed = result.isna() & given
+    if missed.any():
+        result[missed] = pd.to_datetime(series[missed], format='mixed',
+                                        errors='coerce')
+        bad = result.isna() & given
+        if bad.any():
+            raise ValueError(
+                "{} of {} values in {} are not dates, for example {!r}".format(
+                    bad.sum(), len(series), series.name,
+                    series[bad].iloc[0]))
+    return result
+
+
+def to_category(series):
+    """ Convert the answers to an unordered categorical with blanks as NaN
+    """
+    return series.replace('', np.nan).astype('category')
+
+
+def split_multi(series, sep, options=None):
+    """ Split a multi-select answer into a DataFrame with one sparse boolean
+    column per option. The splitting is done only on the unique answers and
+    the result is expanded back out with the factorized codes.
+    """
+    codes, uniques = pd.factorize(series.fillna('').astype(str))
+    choices = [set(c.strip() for c in u.split(sep) if c.strip())
+               for u in uniques]
+    if options is None:
+        options = sorted(set().union(*choices))
+    # Small matrix of unique answers by options
+    lookup = np.array([[opt in c for opt in options] for c in choices],
+                      dtype=bool).reshape(len(uniques), len(options))
+    columns = {}
+    for idx, opt in enumerate(options):
+        mask = lookup[codes, idx]
+        columns["{}-{}".format(series.name, opt)] = pd.arrays.SparseArray(
+            mask, fill_value=False)
+    return pd.DataFrame(columns, index=series.index)
+
+
+def normalize_responses(df, schema=SCHEMA):
+    """ Return a new DataFrame with each column converted based on the schema.
+    Columns not in the schema are left alone.
+    """
+    converted = []
+    for col in df.columns:
+        spec = schema.get(col, {'type': 'text'})
+        kind = spec['type']
+        if kind == 'datetime':
+            converted.append(to_datetime(df[col], spec['format']))
+        elif kind == 'ordinal':
+            converted.append(to_ordinal(df[col], spec['categories']))
+        elif kind == 'category':
+            converted.append(to_category(df[col]))
+        elif kind == 'multi':
+            converted.append(split_multi(df[col], spec['sep'],
+                                         spec.get('options')))
+        else:
+            converted.append(df[col])
+    return pd.concat(converted, axis=1)
+
+
+def memory_report(before, after):
+    """ Return a DataFrame comparing the deep memory usage in bytes of the
+    raw and normalized responses
+    """
+    sizes = pd.DataFrame({'before': [before.memory_usage(deep=True).sum()],
+                          'after': [after.memory_usage(deep=True).sum()]},
+                         index=['bytes'])
+    sizes['reduction'] = 1 - sizes['after'] / sizes['before']
+    return sizes
+
+
+if __name__ == "__main__":
+    # Build a large set of made up responses to show the memory savings
+    rng = np.random.RandomState(42)
+    n = 100000
+    raw = pd.DataFrame({
+        'timestamp': pd.Series(pd.date_range('2015-06-09', periods=n,
+                                             freq='min')).dt.strftime(
+                                                 '%m/%d/%Y %H:%M:%S'),
+        'useful': rng.choice(['1', '2', '3'], n),
+        'freq-py': rng.choice(FREQUENCY_ORDER + [''], n),
+        'os': rng.choice(['Windows', 'Mac', 'Linux'], n),
+        'notify': rng.choice(['RSS', 'Twitter', 'RSS, Twitter',
+                              'Email, RSS', ''], n),
+    })
+    clean = normalize_responses(raw)
+    print(clean.dtypes)
+    print(memory_report(raw, clean))
@@ -0,0 +1,280 @@
+"""
+Opt-in timing and memory spans for the report scripts.
+
+The scripts only print progress messages, so when a report gets slow there
+is no way to tell if reading, merging, pivoting, charting or writing is the
+cost. Wrap each stage in a span:
+
+    from instrument import span, traced
+
+    @traced()
+    def combine_files(src_directory):
+        ...
+
+    with span('pivot', rows_in=len(df)) as s:
+        table = create_pivot(df)
+        s.rows_out = len(table)
+
+Spans nest and record the wall time, CPU time, peak memory allocated while
+they ran (from tracemalloc) and the rows in and out. Nothing is recorded
+unless the PBP_TRACE environment variable is set, and when it is not set a
+span or traced function costs one flag check:
+
+    PBP_TRACE=1 python pandas_gui.py ...          writes pbp_trace.json
+    PBP_TRACE=my_trace.json python create_ppt.py ...
+
+When the script exits a flame style summary of the spans is printed to
+stderr and the spans are saved in the Chrome trace format, which can be
+opened in chrome://tracing or https://ui.perfetto.dev. tracemalloc slows
+down code that allocates a lot of small objects, so compare timings with
+tracing either on or off, not a mix.
+"""
+from __future__ import print_function
+import atexit
+import functools
+import json
+import os
+import sys
+import threading
+import time
+import tracemalloc
+
+ENV_VAR = 'PBP_TRACE'
+DEFAULT_TRACE_FILE = 'pbp_trace.json'
+# Width of the bars in the summary
+BAR_WIDTH = 30
+
+_enabled = False
+_trace_file = None
+_records = []
+_local = threading.local()
+_origin = time.perf_counter()
+
+
+def _stack():
+    """ The open spans of the current thread
+    """
+    if not hasattr(_local, 'stack'):
+        _local.stack = []
+    return _local.stack
+
+
+def count_rows(obj):
+    """ Number of rows in a DataFrame, Series or array, otherwise None
+    """
+    if hasattr(obj, 'shape') and getattr(obj, 'ndim', 0) >= 1:
+        return obj.shape[0]
+    return None
+
+
+class Span(object):
+    """ One timed stage. Set rows_out, or add to attrs, inside the block
+    """
+
+    def __init__(self, name, rows_in=None, attrs=None):
+        self.name = name
+        self.rows_in = rows_in
+        self.rows_out = None
+        self.attrs = attrs or {}
+
+    def __enter__(self):
+        stack = _stack()
+        self.path = (stack[-1].path if stack else ()) + (self.name, )
+        current, peak = tracemalloc.get_traced_memory()
+        if stack:
+            # Resetting the peak below would lose the parent's peak so far
+            stack[-1].mem_high = max(stack[-1].mem_high, peak)
+        tracemalloc.reset_peak()
+        self.mem_start = self.mem_high = current
+        stack.append(self)
+        self.start = time.perf_counter()
+        self.cpu_start = time.process_time()
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        wall = time.perf_counter() - self.start
+        cpu = time.process_time() - self.cpu_start
+        stack = _stack()
+        stack.pop()
+        self.mem_high = max(self.mem_high, tracemalloc.get_traced_memory()[1])
+        if stack:
+            stack[-1].mem_high = max(stack[-1].mem_high, self.mem_high)
+        _records.append({
+            'name': self.name,
+            'path': list(self.path),
+            'start': self.start - _origin,
+            'wall': wall,
+            'cpu': cpu,
+            'peak_mb': (self.mem_high - self.mem_start) / 2**20,
+            'rows_in': self.rows_in,
+            'rows_out': self.rows_out,
+            'error': exc_type.__name__ if exc_type else None,
+            'thread': threading.get_ident(),
+            'attrs': self.attrs})
+        return False
+
+
+class _NullSpan(object):
+    """ Returned by span() when tracing is off. Ignores everything
+    """
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+    def __setattr__(self, name, value):
+        pass
+
+    @property
+    def attrs(self):
+        return {}
+
+
+NULL_SPAN = _NullSpan()
+
+
+def span(name, rows_in=None, **attrs):
+    """ Context manager that records a span if tracing is on.
+    Extra keyword arguments are saved with the span
+    """
+    if not _enabled:
+        return NULL_SPAN
+    return Span(name, rows_in, attrs)
+
+
+def traced(name=None):
+    """ Decorator that records a span for every call of the function.
+    The rows of the first DataFrame argument and of the result are counted
+    """
+
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if not _enabled:
+                return func(*args, **kwargs)
+            rows_in = None
+            for arg in args:
+                rows_in = count_rows(arg)
+                if rows_in is not None:
+                    break
+            with Span(span_name, rows_in) as s:
+                result = func(*args, **kwargs)
+                s.rows_out = count_rows(result)
+            return result
+        return wrapper
+    return decorator
+
+
+def enable(trace_file=DEFAULT_TRACE_FILE):
+    """ Start recording spans. The summary and trace are written when the
+    program exits, or set trace_file to None to only call report yourself
+    """
+    global _enabled, _trace_file
+    if not tracemalloc.is_tracing():
+        tracemalloc.start()
+    if _trace_file is None and trace_file is not None:
+        atexit.register(report)
+    _trace_file = trace_file
+    _enabled = True
+
+
+def disable():
+    """ Stop recording spans
+    """
+    global _enabled
+    _enabled = False
+    tracemalloc.stop()
+
+
+def records():
+    """ The finished spans, in the order they ended
+    """
+    return list(_records)
+
+
+def _format_rows(value):
+    return '' if value is None else '{:,}'.format(value)
+
+
+def summary(spans=None):
+    """ Text tree of the spans with the same path combined. Bars show each
+    stage's share of the total wall time
+    """
+    spans = _records if spans is None else spans
+    totals = {}
+    for s in sorted(spans, key=lambda s: s['start']):
+        path = tuple(s['path'])
+        if path not in totals:
+            totals[path] = {'calls': 0, 'wall': 0, 'cpu': 0, 'peak_mb': 0,
+                            'rows_in': None, 'rows_out': None}
+        total = totals[path]
+        total['calls'] += 1
+        total['wall'] += s['wall']
+        total['cpu'] += s['cpu']
+        total['peak_mb'] = max(total['peak_mb'], s['peak_mb'])
+        for key in ('rows_in', 'rows_out'):
+            if s[key] is not None:
+                total[key] = (total[key] or 0) + s[key]
+    overall = sum(t['wall'] for p, t in totals.items() if len(p) == 1)
+    lines = ['{:<40} {:>6} {:>9} {:>9} {:>9} {:>12} {:>12}  {}'.format(
+        'span', 'calls', 'wall s', 'cpu s', 'peak MB', 'rows in', 'rows out',
+        'share of wall time')]
+
+    def add_children(parent):
+        # Children in the order they first started
+        for path, total in totals.items():
+            if len(path) != len(parent) + 1 or path[:-1] != parent:
+                continue
+            share = total['wall'] / overall if overall else 0
+            label = '  ' * len(parent) + path[-1]
+            lines.append(
+                '{:<40} {:>6} {:>9.3f} {:>9.3f} {:>9.1f} {:>12} {:>12}  '
+                '{}'.format(label[:40], total['calls'], total['wall'],
+                            total['cpu'], total['peak_mb'],
+                            _format_rows(total['rows_in']),
+                            _format_rows(total['rows_out']),
+                            '#' * int(round(share * BAR_WIDTH))))
+            add_children(path)
+
+    add_children(())
+    return '\n'.join(lines)
+
+
+def write_trace(filename, spans=None):
+    """ Save the spans as Chrome trace events
+    """
+    spans = _records if spans is None else spans
+    pid = os.getpid()
+    events = []
+    for s in spans:
+        args = {'cpu_seconds': s['cpu'], 'peak_mb': s['peak_mb'],
+                'rows_in': s['rows_in'], 'rows_out': s['rows_out']}
+        if s['error']:
+            args['error'] = s['error']
+        args.update({k: str(v) for k, v in s['attrs'].items()})
+        events.append({'name': s['name'], 'ph': 'X', 'pid': pid,
+                       'tid': s['thread'], 'ts': s['start'] * 1e6,
+                       'dur': s['wall'] * 1e6, 'args': args})
+    with open(filename, 'w') as f:
+        json.dump({'traceEvents': events, 'displayTimeUnit': 'ms'}, f)
+
+
+def report():
+    """ Print the summary and write the trace file
+    """
+    if not _records:
+        return
+    print(summary(), file=sys.stderr)
+    if _trace_file:
+        write_trace(_trace_file)
+        print("Trace saved to {}".format(_trace_file), file=sys.stderr)
+
+
+_setting = os.environ.get(ENV_VAR, '')
+if _setting not in ('', '0'):
+    enable(DEFAULT_TRACE_FILE if _setting == '1' else _setting)
@@ -0,0 +1,169 @@
+"""
+Sparse market basket analysis for the Online Retail data set.
+
+See https://pbpython.com/market-basket-analysis.html and the
+Market_Basket_Intro notebook for the background.
+
+The notebook builds a dense invoice x product frame with unstack() and then
+calls applymap() on every cell before running apriori. That runs out of
+memory on the full data set. Here the baskets are built as a boolean
+scipy.sparse CSR matrix straight from the categorical codes. The frequent
+itemsets are found with Eclat, which stores the invoices for each item as
+a bitset and finds the support of an itemset by AND-ing the bitsets. The
+output is in the same format as mlxtend's apriori(use_colnames=True) so it
+can be passed to association_rules. Several countries can be mined in
+parallel.
+"""
+from __future__ import print_function
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+import math
+import numpy as np
+import pandas as pd
+from scipy import sparse
+
+DATA_URL = 'http://archive.ics.uci.edu/ml/machine-learning-databases/00352/Online%20Retail.xlsx'
+# No need to track postage
+EXCLUDE_ITEMS = ['POSTAGE']
+
+
+def popcount(value):
+    """ Number of bits set in a python int
+    """
+    if hasattr(value, 'bit_count'):
+        return value.bit_count()
+    return bin(value).count('1')
+
+
+def clean_transactions(df):
+    """ Same clean up as the notebook. Strip the descriptions and remove
+    missing and credit (C) invoices
+    """
+    df = df.dropna(subset=['InvoiceNo']).copy()
+    df['Description'] = df['Description'].str.strip()
+    df['InvoiceNo'] = df['InvoiceNo'].astype('str')
+    return df[~df['InvoiceNo'].str.contains('C')]
+
+
+def build_baskets(df, invoice_col='InvoiceNo', item_col='Description',
+                  qty_col='Quantity', exclude=EXCLUDE_ITEMS):
+    """ Build a sparse boolean invoice x item matrix.
+    An item is in the basket if the total quantity on the invoice is >= 1.
+    Returns the CSR matrix, the invoice labels and the item labels
+    """
+    df = df[df[item_col].notna()]
+    # The excluded items are only dropped from the columns like the notebook,
+    # so an invoice with nothing else stays in as an empty basket
+    invoices = df[invoice_col].astype('category')
+    keep = ~df[item_col].isin(exclude).to_numpy()
+    df = df[keep]
+    items = df[item_col].astype('category')
+    inv_codes = invoices.cat.codes.to_numpy()[keep]
+    item_codes = items.cat.codes.to_numpy()
+    # Total quantity for each invoice and item pair
+    qty = pd.Series(df[qty_col].to_numpy()).groupby(
+        [inv_codes, item_codes]).sum()
+    qty = qty[qty >= 1]
+    rows = qty.index.get_level_values(0).to_numpy()
+    cols = qty.index.get_level_values(1).to_numpy()
+    shape = (len(invoices.cat.categories), len(items.cat.categories))
+    matrix = sparse.csr_matrix((np.ones(len(rows), dtype=bool), (rows, cols)),
+                               shape=shape)
+    return matrix, invoices.cat.categories, items.cat.categories
+
+
+def eclat(matrix, item_names, min_support=0.05, max_len=None):
+    """ Find the frequent itemsets in a sparse boolean basket matrix.
+    Returns a DataFrame with support and itemsets columns like mlxtend
+    """
+    num_baskets = matrix.shape[0]
+    if num_baskets == 0:
+        return pd.DataFrame({'support': [], 'itemsets': []})
+    # Allow for floating point error in min_support * num_baskets
+    min_count = math.ceil(min_support * num_baskets - 1e-9)
+    csc = sparse.csc_matrix(matrix)
+    counts = np.diff(csc.indptr)
+    # Build a bitset of the baskets for every frequent item
+    candidates = []
+    for item in np.nonzero(counts >= min_count)[0]:
+        bits = np.zeros(num_baskets, dtype=bool)
+        bits[csc.indices[csc.indptr[item]:csc.indptr[item + 1]]] = True
+        tidset = int.from_bytes(np.packbits(bits).tobytes(), 'big')
+        candidates.append((item, tidset, int(counts[item])))
+    # Extending the rarest items first keeps the intersections small
+    candidates.sort(key=lambda c: c[2])
+
+    results = []
+    stack = [((), candidates)]
+    while stack:
+        prefix, items = stack.pop()
+        for i, (item, tidset, count) in enumerate(items):
+            itemset = prefix + (item, )
+            results.append((count, itemset))
+            if max_len is not None and len(itemset) >= max_len:
+                continue
+            extensions = []
+            for other, other_tidset, _ in items[i + 1:]:
+                both = tidset & other_tidset
+                both_count = popcount(both)
+                if both_count >= min_count:
+                    extensions.append((other, both, both_count))
+            if extensions:
+                stack.append((itemset, extensions))
+
+    results.sort(key=lambda r: (len(r[1]), sorted(r[1])))
+    names = np.asarray(item_names)
+    return pd.DataFrame({
+        'support': [count / num_baskets for count, _ in results],
+        'itemsets': [frozenset(names[list(itemset)])
+                     for _, itemset in results]
+    })
+
+
+def country_itemsets(df, country, min_support=0.05, max_len=None):
+    """ Build the baskets and the frequent itemsets for one country
+    """
+    matrix, _, items = build_baskets(df[df['Country'] == country])
+    return eclat(matrix, items, min_support, max_len)
+
+
+def _country_itemsets(args):
+    """ Unpack the arguments for use with the process pool
+    """
+    return country_itemsets(*args)
+
+
+def itemsets_by_country(df, countries, min_support=0.05, max_len=None,
+                        workers=None):
+    """ Mine each country in its own process.
+    Returns a dictionary of country -> frequent itemsets DataFrame
+    """
+    tasks = [(df[df['Country'] == c], c, min_support, max_len)
+             for c in countries]
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        results = executor.map(_country_itemsets, tasks)
+        return dict(zip(countries, results))
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Find frequent itemsets in the Online Retail data')
+    parser.add_argument('--infile', default=DATA_URL,
+                        help='Online Retail Excel file')
+    parser.add_argument('--countries', nargs='+',
+                        default=['France', 'Germany'])
+    parser.add_argument('--min-support', type=float, default=0.07)
+    parser.add_argument('--workers', type=int, default=None)
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    retail = clean_transactions(pd.read_excel(args.infile))
+    all_itemsets = itemsets_by_country(retail, args.countries,
+                                       args.min_support, workers=args.workers)
+    for country, itemsets in all_itemsets.items():
+        print(country)
+        print(itemsets.sort_values('support', ascending=False).head(10))
@@ -0,0 +1,253 @@
+""" Generate HTML emails for a whole batch of Markdown files in one run.
+
+This is the batch companion to email_gen.py. The template is compiled and
+its CSS inlined only once. Each document then only needs its own content
+converted and inlined before it is dropped into the pre-built skeleton.
+Documents are spread across worker processes and any output whose source
+and template are unchanged since the last run is skipped.
+
+Refer to https://pbpython.com/ for the details.
+
+"""
+import hashlib
+import json
+import os
+from argparse import ArgumentParser
+from concurrent.futures import ProcessPoolExecutor
+from glob import glob
+from pathlib import Path
+
+from bs4 import BeautifulSoup
+from jinja2 import Environment, FileSystemLoader
+from premailer import transform
+
+from email_gen import parse_doc, clean_HTML, CACHE_DIR
+
+# Placeholders rendered into the template so the per document values
+# can be swapped in after the template has been inlined
+CONTENT_MARKER = 'PBPY-EMAIL-CONTENT-MARKER'
+TITLE_MARKER = 'PBPY-EMAIL-TITLE-MARKER'
+
+# Stores the source and template hashes for every output file
+MANIFEST_NAME = '.email_manifest.json'
+
+# Populated in each worker process by init_worker
+_skeleton = None
+_cache_dir = CACHE_DIR
+
+
+def parse_args():
+    """Parse the command line input
+
+    Returns:
+        args -- ArgumentParser object
+    """
+    parser = ArgumentParser(
+        description='Generate HTML emails from a batch of markdown files')
+    parser.add_argument('source',
+                        action='store',
+                        help='Directory or glob pattern of markdown files')
+    parser.add_argument('-t',
+                        help='email HTML template',
+                        default='template.html')
+    parser.add_argument('-o',
+                        help='output directory. Default is the current directory',
+                        default='.')
+    parser.add_argument('-j',
+                        type=int,
+                        default=None,
+                        help='number of worker processes. Default is one per CPU')
+    parser.add_argument('-c',
+                        help='cache directory for parsed markdown files',
+                        default=CACHE_DIR)
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help='always convert the markdown files')
+    parser.add_argument('--force',
+                        action='store_true',
+                        help='rebuild every output even if nothing changed')
+    args = parser.parse_args()
+    return args
+
+
+def find_docs(source):
+    """Expand a directory or glob pattern into a sorted list of markdown files
+
+    Arguments:
+        source -- directory name or glob pattern
+
+    Returns:
+        list -- Path objects for each markdown file
+    """
+    src = Path(source)
+    if src.is_dir():
+        return sorted(src.glob('*.md'))
+    return sorted(Path(f) for f in glob(source, recursive=True))
+
+
+def output_files(docs, out_dir):
+    """Map each markdown file to its email file in the output directory
+
+    The folders below the common parent of the documents are kept, so posts
+    with the same name in different folders do not overwrite each other.
+
+    Arguments:
+        docs -- list of markdown file Paths
+        out_dir -- Path of the output directory
+
+    Returns:
+        list -- (markdown file, output file, manifest key) tuples
+    """
+    if not docs:
+        return []
+    base = Path(os.path.commonpath([str(d.resolve().parent) for d in docs]))
+    outputs = []
+    seen = {}
+    for in_doc in docs:
+        relative = in_doc.resolve().parent.relative_to(base)
+        key = (relative / f'{in_doc.stem}_email.html').as_posix()
+        if key in seen:
+            raise ValueError(f'{seen[key]} and {in_doc} would both be '
+                             f'written to {key}')
+        seen[key] = in_doc
+        outputs.append((in_doc, out_dir / key, key))
+    return outputs
+
+
+def file_hash(file_name):
+    """Return the sha256 hex digest of a file's contents"""
+    return hashlib.sha256(Path(file_name).read_bytes()).hexdigest()
+
+
+def build_skeleton(template_file):
+    """Compile the template and inline its CSS one time
+
+    The template is rendered with marker strings in place of the title and
+    content, run through premailer and split around the content marker.
+
+    Arguments:
+        template_file -- path to the jinja template
+
+    Returns:
+        dict -- the inlined head and tail of the email plus the template CSS
+    """
+    template_path = Path(template_file)
+    env = Environment(loader=FileSystemLoader(str(template_path.parent)))
+    template = env.get_template(template_path.name)
+    raw_html = template.render({'email_content': CONTENT_MARKER,
+                                'title': TITLE_MARKER})
+
+    # Keep the CSS so each document's content can be inlined on its own
+    soup = BeautifulSoup(raw_html, 'html.parser')
+    css = '\n'.join(style.string or '' for style in soup.find_all('style'))
+
+    head, tail = transform(raw_html).split(CONTENT_MARKER)
+    return {'head': head, 'tail': tail, 'css': css}
+
+
+def inline_content(content, css):
+    """Inline the template CSS into a single HTML content block
+
+    Arguments:
+        content -- HTML fragment converted from the markdown body
+        css -- the style rules taken from the template
+
+    Returns:
+        string -- the content block with all styles inlined
+    """
+    wrapped = (f'<html><head><style type="text/css">{css}</style></head>'
+               f'<body>{content}</body></html>')
+    inlined = transform(wrapped)
+    start = inlined.index('>', inlined.index('<body')) + 1
+    end = inlined.rindex('</body>')
+    return inlined[start:end]
+
+
+def init_worker(skeleton, cache_dir):
+    """Store the pre-built skeleton and cache location in each worker process"""
+    global _skeleton, _cache_dir
+    _skeleton = skeleton
+    _cache_dir = cache_dir
+
+
+def render_doc(in_doc, out_file):
+    """Convert one markdown file and write out the final email HTML
+
+    Arguments:
+        in_doc -- Path to the markdown file
+        out_file -- Path of the HTML file to create
+
+    Returns:
+        Path -- the markdown file that was processed
+    """
+    title, markdown_content = parse_doc(in_doc, _cache_dir)
+    content = inline_content(markdown_content, _skeleton['css'])
+    # The title can be used before or after the content in the template
+    raw_html = ''.join([_skeleton['head'].replace(TITLE_MARKER, title),
+                        content,
+                        _skeleton['tail'].replace(TITLE_MARKER, title)])
+    Path(out_file).parent.mkdir(parents=True, exist_ok=True)
+    Path(out_file).write_text(clean_HTML(raw_html))
+    return in_doc
+
+
+def load_manifest(out_dir):
+    """Read the hashes recorded on the previous run"""
+    manifest_file = Path(out_dir) / MANIFEST_NAME
+    if manifest_file.exists():
+        return json.loads(manifest_file.read_text())
+    return {}
+
+
+def create_batch(config):
+    """Build an email for every markdown file that changed since the last run
+
+    Arguments:
+        config -- ArgumentParser object that contains the input files
+
+    Returns:
+        tuple -- (number of files rendered, number of files skipped)
+    """
+    out_dir = Path(config.o)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    template_hash = file_hash(config.t)
+    manifest = load_manifest(out_dir)
+
+    # Only keep the documents that are new or have changed
+    jobs = []
+    skipped = 0
+    for in_doc, out_file, key in output_files(find_docs(config.source),
+                                              out_dir):
+        hashes = {'source': file_hash(in_doc), 'template': template_hash}
+        if (not config.force and out_file.exists()
+                and manifest.get(key) == hashes):
+            skipped += 1
+            continue
+        jobs.append((in_doc, out_file, key, hashes))
+
+    if jobs:
+        skeleton = build_skeleton(config.t)
+        cache_dir = None if config.no_cache else config.c
+        if config.j == 1:
+            init_worker(skeleton, cache_dir)
+            for in_doc, out_file, _, _ in jobs:
+                render_doc(in_doc, out_file)
+        else:
+            with ProcessPoolExecutor(max_workers=config.j,
+                                     initializer=init_worker,
+                                     initargs=(skeleton, cache_dir)) as executor:
+                list(executor.map(render_doc,
+                                  [job[0] for job in jobs],
+                                  [job[1] for job in jobs]))
+        # Only record the hashes once everything has been written
+        for _, _, key, hashes in jobs:
+            manifest[key] = hashes
+        (out_dir / MANIFEST_NAME).write_text(json.dumps(manifest, indent=2))
+    return len(jobs), skipped
+
+
+if __name__ == '__main__':
+    conf = parse_args()
+    print('Creating output HTML')
+    rendered, skipped = create_batch(conf)
+    print(f'Completed: {rendered} created, {skipped} unchanged')
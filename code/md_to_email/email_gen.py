@@ -4,12 +4,18 @@ Refer to https://pbpython.com/ for the details.
 
 """
 from markdown2 import Markdown
+import hashlib
+import json
+import os
 from pathlib import Path
 from jinja2 import Environment, FileSystemLoader
 from premailer import transform
 from argparse import ArgumentParser
 from bs4 import BeautifulSoup
 
+# Parsed markdown files are stored here keyed by the hash of their contents
+CACHE_DIR = '.email_cache'
+
 
 def parse_args():
     """Parse the command line input
@@ -26,10 +32,123 @@ def parse_args():
                         default='template.html')
     parser.add_argument(
         '-o', help='output filename. Default is inputfile_email.html')
+    parser.add_argument('-c',
+                        help='cache directory for parsed markdown files',
+                        default=CACHE_DIR)
+    parser.add_argument('--no-cache',
+                        action='store_true',
+                        help='always convert the markdown file')
     args = parser.parse_args()
     return args
 
 
+def parse_metadata(lines):
+    """Parse the pelican metadata block at the top of a markdown file
+
+    The block is a series of "Key: value" lines that ends at the first blank
+    line. An optional line of --- before and after the block is also allowed.
+    Indented lines are treated as a continuation of the previous value.
+
+    Arguments:
+        lines -- iterator of the lines in the file
+
+    Returns:
+        tuple -- (metadata dictionary with lower case keys, list of body lines)
+    """
+    metadata = {}
+    key = None
+    lines = iter(lines)
+    for number, line in enumerate(lines):
+        stripped = line.strip()
+        if number == 0 and stripped == '---':
+            continue
+        # A blank line or closing --- marks the end of the header
+        if not stripped or stripped == '---':
+            break
+        if key and line[0] in ' \t':
+            metadata[key] = f'{metadata[key]} {stripped}'
+            continue
+        name, sep, value = line.partition(':')
+        if not sep or ' ' in name.strip():
+            # No metadata block so this line is part of the body
+            return metadata, [line] + list(lines)
+        key = name.strip().lower()
+        metadata[key] = value.strip()
+    return metadata, list(lines)
+
+
+def read_doc(in_doc, cache_dir=CACHE_DIR):
+    """Read in a pelican markdown file and return the metadata and the
+    body converted to HTML
+
+    The parsed result is stored in cache_dir keyed by the hash of the file
+    contents so an unchanged file is never converted twice.
+
+    Arguments:
+        in_doc -- Path to the markdown file
+        cache_dir -- directory for the parsed documents. None disables caching
+
+    Returns:
+        tuple -- (metadata dictionary, markdown_content)
+    """
+    raw = Path(in_doc).read_bytes()
+    if cache_dir is not None:
+        cache_file = Path(cache_dir) / f'{hashlib.sha256(raw).hexdigest()}.json'
+        if cache_file.exists():
+            cached = json.loads(cache_file.read_text())
+            return cached['metadata'], cached['content']
+
+    metadata, body_content = parse_metadata(
+        raw.decode('utf-8').splitlines(keepends=True))
+
+    # Create a markdown object and convert the list of file lines to HTML
+    markdowner = Markdown()
+    markdown_content = markdowner.convert(''.join(body_content))
+
+    if cache_dir is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        # Write to a temp file first so other processes never see a partial file
+        tmp_file = cache_file.with_suffix(f'.{os.getpid()}.tmp')
+        tmp_file.write_text(
+            json.dumps({'metadata': metadata, 'content': markdown_content}))
+        os.replace(tmp_file, cache_file)
+    return metadata, markdown_content
+
+
+def parse_doc(in_doc, cache_dir=CACHE_DIR):
+    """Read in a pelican markdown file and split it into a title and
+    the HTML version of the body
+
+    Arguments:
+        in_doc -- Path to the markdown file
+        cache_dir -- directory for the parsed documents. None disables caching
+
+    Returns:
+        tuple -- (title, markdown_content)
+    """
+    metadata, markdown_content = read_doc(in_doc, cache_dir)
+    title = f"My Newsletter - {metadata.get('title', Path(in_doc).stem)}"
+    return title, markdown_content
+
+
+def clean_HTML(inlined_html):
+    """Tidy up HTML that has already been through premailer
+
+    Arguments:
+        inlined_html -- string of HTML with the CSS inlined
+
+    Returns:
+        string -- the final HTML ready to be written out
+    """
+    # Use BeautifulSoup to make the formatting nicer
+    soup = BeautifulSoup(inlined_html,
+                         'html.parser').prettify(formatter="html")
+
+    # The unsubscribe tag gets mangled. Clean it up.
+    return str(soup).replace('%7B%7BUnsubscribeURL%7D%7D',
+                             '{{UnsubscribeURL}}')
+
+
 def create_HTML(config):
     """Read in the source markdown file and convert it to a standalone
     HTML file suitable for emailing
@@ -45,21 +164,8 @@ def create_HTML(config):
         out_file = Path.cwd() / f'{in_doc.stem}_email.html'
     template_file = config.t
 
-    # Read in the entire file as a list
-    # This can be problematic if the file is really large
-    with open(in_doc) as f:
-        all_content = f.readlines()
-
-    # Get the title line and clean it up
-    title_line = all_content[0]
-    title = f'My Newsletter - {title_line[7:].strip()}'
-
-    # Parse out the body from the meta data content at the top of the file
-    body_content = all_content[6:]
-
-    # Create a markdown object and convert the list of file lines to HTML
-    markdowner = Markdown()
-    markdown_content = markdowner.convert(''.join(body_content))
+    cache_dir = None if config.no_cache else config.c
+    title, markdown_content = parse_doc(in_doc, cache_dir)
 
     # Set up jinja templates
     env = Environment(loader=FileSystemLoader('.'))
@@ -71,13 +177,7 @@ def create_HTML(config):
 
     # Generate the final output string
     # Inline all the CSS using premailer.transform
-    # Use BeautifulSoup to make the formatting nicer
-    soup = BeautifulSoup(transform(raw_html),
-                         'html.parser').prettify(formatter="html")
-
-    # The unsubscribe tag gets mangled. Clean it up.
-    final_HTML = str(soup).replace('%7B%7BUnsubscribeURL%7D%7D',
-                                   '{{UnsubscribeURL}}')
+    final_HTML = clean_HTML(transform(raw_html))
     out_file.write_text(final_HTML)
 
 
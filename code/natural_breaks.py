@@ -0,0 +1,230 @@
+"""
+Bin large series with Fisher-Jenks natural breaks, quantiles or equal widths.
+
+See https://pbpython.com/natural-breaks.html and the Natural_Breaks notebook
+for the background.
+
+jenkspy runs the Jenks dynamic program over every value, which is
+O(k * n^2) and can not be used on millions of rows. Here the program runs
+on the sorted unique values weighted by their counts, which gives exactly
+the same breaks. When there are more than max_values unique values they
+are first merged into max_values groups holding about the same number of
+rows. The sums of squares of the groups are exact, so the result is the
+best set of breaks that fall on a group edge. The breaks are resolved to
+within one group, which is reported as max_rank_error rows, and the
+goodness of variance fit of the result is exact for all of the data.
+
+Breaks are saved to a cache keyed on a fingerprint of the data so they are
+only calculated once. The bins are assigned with np.searchsorted and match
+pd.cut(..., include_lowest=True).
+"""
+from __future__ import print_function
+import argparse
+from collections import namedtuple
+import hashlib
+import json
+import os
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+CACHE_DIR = '.breaks_cache'
+# Largest number of values passed to the dynamic program. It uses
+# O(max_values^2) memory
+MAX_VALUES = 2000
+
+JenksResult = namedtuple('JenksResult',
+                         ['breaks', 'gvf', 'exact', 'max_rank_error'])
+
+
+def _group_values(values, max_values):
+    """ Sort the values and merge them into at most max_values groups.
+    Returns the count, sum, sum of squares and largest value of each group
+    and whether any values were merged
+    """
+    uniques, counts = np.unique(values, return_counts=True)
+    if len(uniques) <= max_values:
+        return counts, uniques * counts, uniques**2 * counts, uniques, False
+    # Cut the unique values into groups with about the same number of rows
+    cum_counts = np.cumsum(counts)
+    targets = np.linspace(0, cum_counts[-1], max_values + 1)[1:-1]
+    ends = np.unique(np.searchsorted(cum_counts, targets, side='left'))
+    starts = np.concatenate([[0], ends + 1])
+    starts = starts[starts < len(uniques)]
+    last = np.concatenate([starts[1:] - 1, [len(uniques) - 1]])
+    return (np.add.reduceat(counts, starts),
+            np.add.reduceat(uniques * counts, starts),
+            np.add.reduceat(uniques**2 * counts, starts),
+            uniques[last], True)
+
+
+def fisher_jenks(values, n_classes, max_values=MAX_VALUES):
+    """ Find the natural breaks in an array of values.
+
+    Args:
+        values = array of numbers, missing values are ignored
+        n_classes = number of classes
+        max_values = largest number of unique values to use before the
+                     values are merged into groups
+    Returns:
+        JenksResult with the breaks in the same format as
+        jenkspy.jenks_breaks, the goodness of variance fit, whether the
+        result is exact and the largest number of rows a break can be off
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    # Center the values so the sums of squares do not lose precision
+    center = values.mean()
+    weights, sums, squares, maxes, grouped = _group_values(values - center,
+                                                           max_values)
+    maxes = maxes + center
+    m = len(weights)
+    if n_classes < 1 or n_classes > m:
+        raise ValueError("n_classes must be between 1 and {}".format(m))
+
+    # Sum of squared deviations for the groups s through i
+    cw, cs, cq = [np.concatenate([[0], np.cumsum(a)])
+                  for a in (weights, sums, squares)]
+    w = cw[None, 1:] - cw[:-1, None]
+    with np.errstate(divide='ignore', invalid='ignore'):
+        ssd = (cq[None, 1:] - cq[:-1, None]) - (
+            cs[None, 1:] - cs[:-1, None])**2 / w
+    upper = np.triu(np.ones((m, m), dtype=bool))
+    ssd = np.where(upper, np.maximum(ssd, 0), np.inf)
+
+    # cost[i] is the best sum for the groups 0 through i in j classes
+    cost = ssd[0]
+    starts = np.zeros((n_classes, m), dtype=np.int64)
+    for j in range(1, n_classes):
+        # Class j starts at group s, the earlier classes end at s - 1
+        total = cost[:-1, None] + ssd[1:]
+        best = np.argmin(total, axis=0)
+        cost = total[best, np.arange(m)]
+        starts[j] = best + 1
+
+    # Walk back through the starting groups to find each class end
+    ends = [m - 1]
+    for j in range(n_classes - 1, 0, -1):
+        ends.append(starts[j, ends[-1]] - 1)
+    breaks = [float(values.min())] + [float(maxes[e]) for e in ends[::-1]]
+
+    total_ssd = cq[-1] - cs[-1]**2 / cw[-1]
+    gvf = 1 - cost[m - 1] / total_ssd if total_ssd > 0 else 1.0
+    max_rank_error = int(weights.max()) if grouped else 0
+    return JenksResult(breaks, float(gvf), not grouped, max_rank_error)
+
+
+def jenks_breaks(values, nb_class, max_values=MAX_VALUES):
+    """ Drop in replacement for jenkspy.jenks_breaks
+    """
+    return fisher_jenks(values, nb_class, max_values).breaks
+
+
+def compute_breaks(values, n_classes, method='jenks', max_values=MAX_VALUES):
+    """ Return the n_classes + 1 bin edges using one of the methods:
+    jenks - natural breaks
+    quantile - the same number of rows in each bin like pd.qcut
+    equal - bins of the same width like pd.cut(bins=n_classes)
+    """
+    values = np.asarray(values, dtype=float)
+    values = values[~np.isnan(values)]
+    if method == 'jenks':
+        return fisher_jenks(values, n_classes, max_values).breaks
+    if method == 'quantile':
+        return np.quantile(values, np.linspace(0, 1, n_classes + 1)).tolist()
+    if method == 'equal':
+        return np.linspace(values.min(), values.max(),
+                           n_classes + 1).tolist()
+    raise ValueError("Unknown method: {}".format(method))
+
+
+def fingerprint(values):
+    """ sha256 of the values and their type
+    """
+    values = np.ascontiguousarray(values)
+    digest = hashlib.sha256(str(values.dtype).encode())
+    digest.update(values.tobytes())
+    return digest.hexdigest()
+
+
+def cached_breaks(values, n_classes, method='jenks', max_values=MAX_VALUES,
+                  cache_dir=CACHE_DIR):
+    """ Same as compute_breaks but the result is saved in cache_dir.
+    Pass cache_dir=None to skip the cache
+    """
+    if cache_dir is None:
+        return compute_breaks(values, n_classes, method, max_values)
+    key = hashlib.sha256("{}|{}|{}|{}".format(
+        fingerprint(values), method, n_classes, max_values).encode())
+    cache_file = Path(cache_dir) / '{}.json'.format(key.hexdigest())
+    if cache_file.exists():
+        return json.loads(cache_file.read_text())
+    breaks = compute_breaks(values, n_classes, method, max_values)
+    Path(cache_dir).mkdir(parents=True, exist_ok=True)
+    tmp_file = cache_file.with_suffix('.tmp')
+    tmp_file.write_text(json.dumps(breaks))
+    os.replace(tmp_file, cache_file)
+    return breaks
+
+
+def assign_bins(values, breaks, labels=None):
+    """ Put each value in a bin. Same as pd.cut(values, bins=breaks,
+    labels=labels, include_lowest=True) but the labels are only built once
+    and repeated breaks give an empty bin instead of an error.
+    Values outside of the breaks are missing
+    """
+    values = np.asarray(values, dtype=float)
+    breaks = np.asarray(breaks, dtype=float)
+    if labels is None:
+        labels = ['bucket_{}'.format(i) for i in range(1, len(breaks))]
+    if len(labels) != len(breaks) - 1:
+        raise ValueError("Need {} labels for {} breaks".format(
+            len(breaks) - 1, len(breaks)))
+    # Bin i holds the values in (breaks[i], breaks[i + 1]]
+    codes = np.searchsorted(breaks[1:-1], values, side='left')
+    outside = (values < breaks[0]) | (values > breaks[-1]) | np.isnan(values)
+    codes[outside] = -1
+    return pd.Categorical.from_codes(codes, labels)
+
+
+def natural_bins(series, n_classes, method='jenks', labels=None,
+                 max_values=MAX_VALUES, cache_dir=CACHE_DIR):
+    """ Bin a Series and return a categorical Series with the same index
+    """
+    values = series.to_numpy(dtype=float)
+    breaks = cached_breaks(values, n_classes, method, max_values, cache_dir)
+    return pd.Series(assign_bins(values, breaks, labels), index=series.index,
+                     name=series.name)
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(description='Bin a column of a file')
+    parser.add_argument('infile', help='csv or Excel file')
+    parser.add_argument('column', help='Column to bin')
+    parser.add_argument('-k', type=int, default=4, help='Number of bins')
+    parser.add_argument('--method', default='jenks',
+                        choices=['jenks', 'quantile', 'equal'])
+    parser.add_argument('--max-values', type=int, default=MAX_VALUES)
+    parser.add_argument('--no-cache', action='store_true')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    if args.infile.endswith('.csv'):
+        df = pd.read_csv(args.infile)
+    else:
+        df = pd.read_excel(args.infile)
+    values = df[args.column].to_numpy(dtype=float)
+    if args.method == 'jenks':
+        result = fisher_jenks(values, args.k, args.max_values)
+        print("Breaks: {}".format(result.breaks))
+        print("Goodness of variance fit: {:.4f}".format(result.gvf))
+        if not result.exact:
+            print("Breaks are within {} rows".format(result.max_rank_error))
+    bins = natural_bins(df[args.column], args.k, args.method,
+                        max_values=args.max_values,
+                        cache_dir=None if args.no_cache else CACHE_DIR)
+    print(bins.value_counts(sort=False))
@@ -9,12 +9,17 @@ a pandas DataFrame.
 from __future__ import print_function
 import gspread
 from oauth2client.client import SignedJwtAssertionCredentials
-import pandas as pd
 import json
+from gform_loader import load_responses
+from gform_normalize import normalize_responses, memory_report
 
 SCOPE = ["https://spreadsheets.google.com/feeds"]
 SECRETS_FILE = "Pbpython-key.json"
 SPREADSHEET = "PBPython User Survey (Responses)"
+# Responses are cached here so each run only downloads the new rows
+CACHE_DIR = "gform_cache"
+# Listing every sheet in the account is slow so only do it when needed
+LIST_SHEETS = False
 # Based on docs here - http://gspread.readthedocs.org/en/latest/oauth2.html
 # Load in the secret JSON key (must be a service account)
 json_key = json.load(open(SECRETS_FILE))
@@ -23,15 +28,16 @@ credentials = SignedJwtAssertionCredentials(json_key['client_email'],
                                             json_key['private_key'], SCOPE)
 
 gc = gspread.authorize(credentials)
-print("The following sheets are available")
-for sheet in gc.openall():
-    print("{} - {}".format(sheet.title, sheet.id))
+if LIST_SHEETS:
+    print("The following sheets are available")
+    for sheet in gc.openall():
+        print("{} - {}".format(sheet.title, sheet.id))
 # Open up the workbook based on the spreadsheet name
 workbook = gc.open(SPREADSHEET)
 # Get the first sheet
 sheet = workbook.sheet1
-# Extract all data into a dataframe
-data = pd.DataFrame(sheet.get_all_records())
+# Pull any new rows into the local cache and load everything into a dataframe
+data = load_responses(sheet, CACHE_DIR)
 # Do some minor cleanups on the data
 # Rename the columns to make it easier to manipulate
 # The data comes in through a dictionary so we can not assume order stays the
@@ -51,5 +57,7 @@ column_names = {'Timestamp': 'timestamp',
                 'How would you like to be notified about new articles on this site?': 'notify'
                 }
 data.rename(columns=column_names, inplace=True)
-data.timestamp = pd.to_datetime(data.timestamp)
-print(data.head())
+# Convert the strings to datetimes, ordered categories and boolean columns
+clean_data = normalize_responses(data)
+print(memory_report(data, clean_data))
+print(clean_data.head())
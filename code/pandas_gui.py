@@ -3,22 +3,23 @@
 Simple Pandas program to combine Excel files and summarize data.
 See http://pbpython.com/pandas-gui.html for details on this script
 This demonstrates the use of Gooey to add a simple UI on top of the script
+
+Set PBP_TRACE=1 to see how long each stage takes, see instrument.py
 """
 from __future__ import print_function
 import pandas as pd
-import numpy as np
 import glob
 import os
 import json
-from gooey import Gooey, GooeyParser
+from instrument import span, traced
 
 
-@Gooey(program_name="Create Quarterly Marketing Report")
 def parse_args():
     """ Use GooeyParser to build up the arguments we will use in our script
     Save the arguments in a default json file so that we can retrieve them
     every time we run the script.
     """
+    from gooey import GooeyParser
     stored_args = {}
     # get the script name without the extension & use it to build up
     # the json filename
@@ -55,44 +56,65 @@ def parse_args():
     return args
 
 
+@traced()
 def combine_files(src_directory):
     """ Read in all of the sales xlsx files and combine into 1
     combined DataFrame
     """
-    all_data = pd.DataFrame()
+    files = []
     for f in glob.glob(os.path.join(src_directory, "sales-*.xlsx")):
-        df = pd.read_excel(f)
-        all_data = all_data.append(df, ignore_index=True)
-    all_data['date'] = pd.to_datetime(all_data['date'])
+        with span('read_excel', file=os.path.basename(f)) as s:
+            df = pd.read_excel(f)
+            s.rows_out = len(df)
+        files.append(df)
+    # Concatenate once instead of copying the combined data for every file
+    with span('concat', rows_in=sum(len(df) for df in files)) as s:
+        all_data = pd.concat(files, ignore_index=True)
+        all_data['date'] = pd.to_datetime(all_data['date'])
+        s.rows_out = len(all_data)
     return all_data
 
 
+@traced()
 def add_customer_status(sales_data, customer_file):
     """ Read in the customer file and combine with the sales data
     Return the customer with their status as an ordered category
     """
-    df = pd.read_excel(customer_file)
-    all_data = pd.merge(sales_data, df, how='left')
+    with span('read_excel', file=os.path.basename(customer_file)) as s:
+        df = pd.read_excel(customer_file)
+        s.rows_out = len(df)
+    with span('merge', rows_in=len(sales_data)) as s:
+        all_data = pd.merge(sales_data, df, how='left')
+        s.rows_out = len(all_data)
     # Default everyone to bronze if no data included
-    all_data['status'].fillna('bronze', inplace=True)
+    all_data['status'] = all_data['status'].fillna('bronze')
     # Convert the status to a category and order it
-    all_data["status"] = all_data["status"].astype("category")
-    all_data["status"].cat.set_categories(["gold", "silver", "bronze"], inplace=True)
+    all_data["status"] = pd.Categorical(all_data["status"],
+                                        categories=["gold", "silver", "bronze"])
     return all_data
 
 
+@traced()
 def save_results(sales_data, output):
     """ Perform a summary of the data and save the data as an excel file
     """
-    summarized_sales = sales_data.groupby(["status"])["unit price"].agg([np.mean])
+    with span('summarize', rows_in=len(sales_data)) as s:
+        summarized_sales = sales_data.groupby(
+            ["status"], observed=False)["unit price"].agg(['mean'])
+        s.rows_out = len(summarized_sales)
     output_file = os.path.join(output, "sales-report.xlsx")
-    writer = pd.ExcelWriter(output_file, engine='xlsxwriter')
     summarized_sales = summarized_sales.reset_index()
-    summarized_sales.to_excel(writer)
+    with span('write_excel', rows_in=len(summarized_sales), file=output_file):
+        with pd.ExcelWriter(output_file, engine='xlsxwriter') as writer:
+            summarized_sales.to_excel(writer)
 
 
 if __name__ == '__main__':
-    conf = parse_args()
+    # Gooey is only imported here so the functions above can be imported,
+    # for example by benchmarks.py, without a display
+    from gooey import Gooey
+    conf = Gooey(program_name="Create Quarterly Marketing Report")(
+        parse_args)()
     print("Reading sales files")
     sales_df = combine_files(conf.data_directory)
     print("Reading customer data and combining with sales")
@@ -1,14 +1,35 @@
 import pandas as pd
-from sqlalchemy import create_engine
-from xlwings import Workbook, Range
 import os
 
 
+def account_summary(engine, account, start_date, end_date):
+    """
+    Read the sales for one account between two dates from the database
+    Return the quantity and price summed by sku and the total sales
+    """
+    # Create SQL query
+    sql = 'SELECT * from sales WHERE account="{}" AND date BETWEEN "{}" AND "{}"'.format(account, start_date, end_date)
+
+    # Read query directly into a dataframe
+    sales_data = pd.read_sql(sql, engine)
+
+    # Analyze the data however we want
+    summary = sales_data.groupby(["sku"])[["quantity", "ext-price"]].sum()
+
+    total_sales = sales_data["ext-price"].sum()
+    return summary, total_sales
+
+
 def summarize_sales():
     """
     Retrieve the account number and date ranges from the Excel sheet
     Read in the data from the sqlite database, then manipulate and return it to excel
     """
+    # Only needed when called from Excel, so account_summary can be
+    # imported without them
+    from sqlalchemy import create_engine
+    from xlwings import Workbook, Range
+
     # Make a connection to the calling Excel file
     wb = Workbook.caller()
 
@@ -27,16 +48,8 @@ def summarize_sales():
     # Clear existing data
     Range('A5:F100').clear_contents()
 
-    # Create SQL query
-    sql = 'SELECT * from sales WHERE account="{}" AND date BETWEEN "{}" AND "{}"'.format(account, start_date, end_date)
-
-    # Read query directly into a dataframe
-    sales_data = pd.read_sql(sql, engine)
-
-    # Analyze the data however we want
-    summary = sales_data.groupby(["sku"])["quantity", "ext-price"].sum()
-
-    total_sales = sales_data["ext-price"].sum()
+    summary, total_sales = account_summary(engine, account, start_date,
+                                           end_date)
 
     # Output the results
     if summary.empty:
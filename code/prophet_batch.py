@@ -0,0 +1,427 @@
+"""
+Fit Prophet forecasts for many series at once.
+
+See http://pbpython.com/prophet-overview.html and the
+Forecasting-with-prophet and Prophet-Accuracy-Check notebooks for the
+background on the model.
+
+The notebooks fit one model for one series. forecast_batch takes a long
+DataFrame with a series id, ds and y column and fits every series in a
+pool of worker processes. Fitted models are saved as json in a cache folder
+under a hash of the series data and model settings, so series that have
+not changed since the last run are loaded instead of fit again.
+
+cross_validate_batch splits every series into cutoff windows like
+prophet.diagnostics.cross_validation and sends all of the windows for all
+of the series to the same pool.
+
+Each fit has a time limit so one bad series can not hold up the run. Stan
+does the fitting in C++ or in a separate cmdstan process, where a Python
+signal can not stop it, so the limit is enforced by the parent process.
+Every worker runs in its own process group and a worker that is still busy
+when its time is up is killed along with its cmdstan processes and
+replaced. On Windows only the worker itself can be killed. Both functions
+return the status of every fit so timeouts and errors are never dropped
+silently.
+"""
+from __future__ import print_function
+import argparse
+import hashlib
+import json
+import logging
+import multiprocessing
+from multiprocessing import connection
+import os
+import signal
+import time
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+try:
+    from prophet import Prophet
+    from prophet.serialize import model_from_json, model_to_json
+except ImportError:
+    # Older installs use the original package name
+    from fbprophet import Prophet
+    from fbprophet.serialize import model_from_json, model_to_json
+
+CACHE_DIR = 'prophet_cache'
+# Seconds allowed for one model fit
+TIMEOUT = 300
+FORECAST_COLUMNS = ['ds', 'yhat', 'yhat_lower', 'yhat_upper']
+
+
+def init_worker():
+    """ Stan and Prophet log every fit, which is too much for a batch
+    """
+    for name in ['prophet', 'fbprophet', 'cmdstanpy']:
+        logging.getLogger(name).setLevel(logging.WARNING)
+
+
+def series_hash(data, model_kwargs):
+    """ sha256 of the ds and y values and the model settings
+    """
+    digest = hashlib.sha256()
+    digest.update(pd.util.hash_pandas_object(data[['ds', 'y']],
+                                             index=False).to_numpy().tobytes())
+    settings = json.dumps(model_kwargs, sort_keys=True,
+                          default=lambda o: o.to_json()
+                          if hasattr(o, 'to_json') else str(o))
+    digest.update(settings.encode())
+    return digest.hexdigest()
+
+
+def fit_model(data, model_kwargs, cache_dir=None):
+    """ Return a fitted model, from the cache if the data has not changed,
+    and whether it came from the cache
+    """
+    cache_file = None
+    if cache_dir is not None:
+        cache_file = Path(cache_dir) / '{}.json'.format(
+            series_hash(data, model_kwargs))
+        if cache_file.exists():
+            return model_from_json(cache_file.read_text()), True
+    model = Prophet(**model_kwargs).fit(data)
+    if cache_file is not None:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        tmp_file = cache_file.with_suffix('.{}.tmp'.format(os.getpid()))
+        tmp_file.write_text(model_to_json(model))
+        os.replace(tmp_file, cache_file)
+    return model, False
+
+
+def forecast_series(task):
+    """ Fit or load the model for one series and predict the future.
+    Returns the forecast (or None) and a status dictionary
+    """
+    series_id, data, model_kwargs, periods, freq, cache_dir = task
+    start = time.perf_counter()
+    status = {'series_id': series_id, 'rows': len(data)}
+    forecast = None
+    try:
+        model, cached = fit_model(data, model_kwargs, cache_dir)
+        future = model.make_future_dataframe(periods=periods, freq=freq)
+        forecast = model.predict(future)[FORECAST_COLUMNS]
+        forecast.insert(0, 'series_id', series_id)
+        status['status'] = 'cached' if cached else 'fit'
+    except Exception as e:
+        status['status'] = 'error'
+        status['message'] = '{}: {}'.format(type(e).__name__, e)
+    status['seconds'] = time.perf_counter() - start
+    return forecast, status
+
+
+def series_failed(task, status, message, seconds):
+    """ Result for a series whose worker was killed or died
+    """
+    series_id, data = task[:2]
+    return None, {'series_id': series_id, 'rows': len(data),
+                  'status': status, 'message': message, 'seconds': seconds}
+
+
+def split_series(df, id_col):
+    """ Return a list of (series id, ds/y DataFrame) pairs
+    """
+    return [(series_id, group[['ds', 'y']].reset_index(drop=True))
+            for series_id, group in df.groupby(id_col, sort=True)]
+
+
+def _worker_main(conn, func):
+    """ Run the tasks sent by run_tasks until told to stop
+    """
+    if hasattr(os, 'setsid'):
+        # A new process group so the cmdstan processes started by a fit
+        # are killed along with the worker
+        os.setsid()
+    init_worker()
+    while True:
+        try:
+            task = conn.recv()
+        except EOFError:
+            break
+        if task is None:
+            break
+        conn.send(func(task))
+
+
+class Worker(object):
+    """ A process that runs one task at a time, so a task that runs too
+    long can be stopped by killing the process
+    """
+
+    def __init__(self, context, func):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(target=_worker_main,
+                                       args=(child_conn, func))
+        self.process.start()
+        child_conn.close()
+        self.index = None
+        self.started = None
+
+    def submit(self, index, task):
+        self.index = index
+        self.started = time.monotonic()
+        self.conn.send(task)
+
+    def kill(self):
+        """ Kill the worker and anything it started
+        """
+        try:
+            if hasattr(os, 'killpg'):
+                os.killpg(self.process.pid, signal.SIGKILL)
+            else:
+                self.process.kill()
+        except ProcessLookupError:
+            self.process.kill()
+        self.process.join()
+        self.conn.close()
+
+    def close(self):
+        """ Let an idle worker exit
+        """
+        try:
+            self.conn.send(None)
+        except OSError:
+            pass
+        self.process.join()
+        self.conn.close()
+
+
+def run_tasks(func, tasks, workers=None, timeout=None, failed=None):
+    """ Run func on every task and return the results in order.
+
+    Args:
+        func = function taking one task, run in the worker processes
+        tasks = list of tasks
+        workers = number of worker processes. 1 without a timeout runs the
+                  tasks in this process
+        timeout = seconds a task may run before its worker is killed
+        failed = function(task, status, message, seconds) that gives the
+                 result for a task that timed out or whose worker died
+    """
+    if workers == 1 and not timeout:
+        init_worker()
+        return [func(t) for t in tasks]
+    if not tasks:
+        return []
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    context = multiprocessing.get_context()
+    results = [None] * len(tasks)
+    pending = list(enumerate(tasks))[::-1]
+    pool = [Worker(context, func) for _ in range(workers)]
+    try:
+        while pending or any(w.index is not None for w in pool):
+            for w in pool:
+                if w.index is None and pending:
+                    w.submit(*pending.pop())
+            busy = [w for w in pool if w.index is not None]
+            wait = None
+            if timeout:
+                wait = max(0, min(w.started for w in busy) + timeout -
+                           time.monotonic())
+            ready = connection.wait([w.conn for w in busy], wait)
+            for i, w in enumerate(pool):
+                if w.index is None:
+                    continue
+                seconds = time.monotonic() - w.started
+                if w.conn in ready:
+                    try:
+                        results[w.index] = w.conn.recv()
+                        w.index = None
+                        continue
+                    except EOFError:
+                        status = 'error'
+                        message = 'Worker exited with code {}'.format(
+                            w.process.exitcode)
+                elif timeout and seconds >= timeout:
+                    status = 'timeout'
+                    message = 'Stopped after {} seconds'.format(timeout)
+                else:
+                    continue
+                index = w.index
+                w.kill()
+                pool[i] = Worker(context, func)
+                if failed is not None:
+                    results[index] = failed(tasks[index], status, message,
+                                            seconds)
+    finally:
+        for w in pool:
+            if w.index is None:
+                w.close()
+            else:
+                w.kill()
+    return results
+
+
+def forecast_batch(df, id_col='series_id', periods=90, freq='D',
+                   model_kwargs=None, cache_dir=CACHE_DIR, workers=None,
+                   timeout=TIMEOUT):
+    """ Forecast every series in a long DataFrame.
+
+    Args:
+        df = DataFrame with id_col, ds and y columns
+        periods, freq = how far ahead to forecast
+        model_kwargs = arguments for Prophet(), for example holidays
+        cache_dir = folder for the fitted models, None turns off the cache
+        workers = number of worker processes
+        timeout = seconds allowed for each fit, None for no limit
+    Returns:
+        a DataFrame of all of the forecasts and a DataFrame with the status
+        of each series: fit, cached, timeout or error
+    """
+    model_kwargs = model_kwargs or {}
+    tasks = [(series_id, data, model_kwargs, periods, freq, cache_dir)
+             for series_id, data in split_series(df, id_col)]
+    results = run_tasks(forecast_series, tasks, workers, timeout,
+                        series_failed)
+    forecasts = [f for f, _ in results if f is not None]
+    status = pd.DataFrame([s for _, s in results])
+    if forecasts:
+        forecasts = pd.concat(forecasts, ignore_index=True)
+    else:
+        forecasts = pd.DataFrame(columns=['series_id'] + FORECAST_COLUMNS)
+    return (forecasts.rename(columns={'series_id': id_col}),
+            status.rename(columns={'series_id': id_col}))
+
+
+def cutoff_dates(ds, horizon, period, initial):
+    """ Same cutoffs as prophet.diagnostics.cross_validation. Work back from
+    the end by period while leaving initial for the first training window
+    """
+    horizon, period, initial = [pd.Timedelta(x)
+                                for x in (horizon, period, initial)]
+    cutoff = ds.max() - horizon
+    cutoffs = []
+    while cutoff >= ds.min() + initial:
+        cutoffs.append(cutoff)
+        cutoff -= period
+    return cutoffs[::-1]
+
+
+def forecast_window(task):
+    """ Fit on the data up to the cutoff and predict the horizon after it.
+    Returns the forecast (or None) and a status dictionary
+    """
+    series_id, data, model_kwargs, cutoff, horizon = task
+    start = time.perf_counter()
+    status = {'series_id': series_id, 'cutoff': cutoff}
+    forecast = None
+    train = data[data['ds'] <= cutoff]
+    test = data[(data['ds'] > cutoff) &
+                (data['ds'] <= cutoff + pd.Timedelta(horizon))]
+    try:
+        model = Prophet(**model_kwargs).fit(train)
+        forecast = model.predict(test[['ds']])[FORECAST_COLUMNS]
+        forecast['y'] = test['y'].to_numpy()
+        forecast['cutoff'] = cutoff
+        forecast.insert(0, 'series_id', series_id)
+        status['status'] = 'fit'
+    except Exception as e:
+        status['status'] = 'error'
+        status['message'] = '{}: {}'.format(type(e).__name__, e)
+    status['seconds'] = time.perf_counter() - start
+    return forecast, status
+
+
+def window_failed(task, status, message, seconds):
+    """ Result for a window whose worker was killed or died
+    """
+    series_id, cutoff = task[0], task[3]
+    return None, {'series_id': series_id, 'cutoff': cutoff,
+                  'status': status, 'message': message, 'seconds': seconds}
+
+
+def cross_validate_batch(df, horizon, period=None, initial=None,
+                         id_col='series_id', model_kwargs=None,
+                         workers=None, timeout=TIMEOUT):
+    """ Cross validate every series with all of the windows run in parallel.
+    period and initial default to half a horizon and three horizons like
+    prophet. Returns the same columns as prophet's cross_validation plus
+    the series id, and a DataFrame with the status of every window: fit,
+    timeout or error. Failed windows have no rows in the first DataFrame
+    """
+    model_kwargs = model_kwargs or {}
+    horizon = pd.Timedelta(horizon)
+    period = pd.Timedelta(period) if period is not None else horizon / 2
+    initial = pd.Timedelta(initial) if initial is not None else 3 * horizon
+    tasks = []
+    for series_id, data in split_series(df, id_col):
+        for cutoff in cutoff_dates(data['ds'], horizon, period, initial):
+            tasks.append((series_id, data, model_kwargs, cutoff, horizon))
+    results = run_tasks(forecast_window, tasks, workers, timeout,
+                        window_failed)
+    forecasts = [f for f, _ in results if f is not None]
+    status = pd.DataFrame([s for _, s in results],
+                          columns=['series_id', 'cutoff', 'status', 'message',
+                                   'seconds'])
+    if forecasts:
+        cv = pd.concat(forecasts, ignore_index=True)
+    else:
+        cv = pd.DataFrame(columns=['series_id'] + FORECAST_COLUMNS +
+                          ['y', 'cutoff'])
+    return (cv.rename(columns={'series_id': id_col}),
+            status.rename(columns={'series_id': id_col}))
+
+
+def performance(cv, id_col='series_id', status=None):
+    """ Mean absolute error, RMSE, MAPE and interval coverage per series
+    with the number of windows they are based on. Pass the status from
+    cross_validate_batch to add the number of windows that failed
+    """
+    error = cv['y'] - cv['yhat']
+    metrics = pd.DataFrame({
+        id_col: cv[id_col],
+        'mae': error.abs(),
+        'mse': error**2,
+        'mape': (error / cv['y']).abs(),
+        'coverage': ((cv['y'] >= cv['yhat_lower']) &
+                     (cv['y'] <= cv['yhat_upper'])).astype(float)})
+    result = metrics.groupby(id_col).mean()
+    result.insert(1, 'rmse', np.sqrt(result.pop('mse')))
+    result['windows'] = cv.groupby(id_col)['cutoff'].nunique()
+    if status is not None:
+        failed = status[status['status'] != 'fit'].groupby(id_col).size()
+        result = result.reindex(result.index.union(status[id_col].unique()))
+        result['windows'] = result['windows'].fillna(0).astype(int)
+        result['failed_windows'] = failed.reindex(result.index,
+                                                  fill_value=0)
+    return result
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Forecast many series with Prophet')
+    parser.add_argument('infile', help='csv file with series_id, ds and y')
+    parser.add_argument('-o', default='forecasts.csv', help='Output file')
+    parser.add_argument('--id-col', default='series_id')
+    parser.add_argument('--periods', type=int, default=90)
+    parser.add_argument('--workers', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=TIMEOUT,
+                        help='Seconds allowed for each fit, 0 for no limit')
+    parser.add_argument('--no-cache', action='store_true')
+    parser.add_argument('--cv-horizon',
+                        help='Cross validate with this horizon, e.g. 30d')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    data = pd.read_csv(args.infile, parse_dates=['ds'])
+    timeout = args.timeout or None
+    if args.cv_horizon:
+        cv, status = cross_validate_batch(data, args.cv_horizon,
+                                          id_col=args.id_col,
+                                          workers=args.workers,
+                                          timeout=timeout)
+        print(status['status'].value_counts())
+        print(performance(cv, args.id_col, status))
+    else:
+        forecasts, status = forecast_batch(
+            data, args.id_col, args.periods, workers=args.workers,
+            timeout=timeout,
+            cache_dir=None if args.no_cache else CACHE_DIR)
+        print(status['status'].value_counts())
+        forecasts.to_csv(args.o, index=False)
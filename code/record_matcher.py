@@ -0,0 +1,304 @@
+"""
+Blocked TF-IDF fuzzy matching for linking two sets of account records.
+
+See https://pbpython.com/record-linking.html for the background.
+
+fuzzymatcher.fuzzy_left_join compares every record on the left with the
+records on the right and takes several minutes on the hospital data set.
+This version only compares records that share a blocking key such as the
+state or the first digits of the zip code. Every record is turned into a
+character n-gram TF-IDF vector so the comparison for a block is a sparse
+matrix product, which only touches the n-grams two records have in common.
+Blocks are scored in chunks across a pool of worker processes.
+
+The output matches fuzzy_left_join: one row per left record with a
+best_match_score (the cosine similarity from 0 to 1), the ids of the two
+records and all of the columns from both sides.
+
+Requires scikit-learn and scipy.
+"""
+from __future__ import print_function
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+from functools import reduce
+import time
+import numpy as np
+import pandas as pd
+from sklearn.feature_extraction.text import TfidfVectorizer
+
+# Number of left records scored against a block at one time
+CHUNK_SIZE = 2000
+# Approximate number of record pairs to send to a worker in one task
+TASK_PAIRS = 5_000_000
+
+# Populated in each worker process by init_worker
+_left_vectors = None
+_right_vectors = None
+
+
+def column_key(*cols):
+    """ Blocking key made from one or more columns joined together
+    """
+    def key(df):
+        parts = [df[c].astype(str).str.strip().str.upper() for c in cols]
+        return reduce(lambda a, b: a + "|" + b, parts)
+    return key
+
+
+def zip_key(zip_col, *cols, digits=3):
+    """ Blocking key made from the first digits of a zip code plus any
+    other columns
+    """
+    def key(df):
+        zips = df[zip_col].astype(str).str.strip().str.zfill(5).str[:digits]
+        if cols:
+            return column_key(*cols)(df) + "|" + zips
+        return zips
+    return key
+
+
+# Block on state, on the 3 digit zip code prefix and on city within state.
+# Every pair of records that shares any of these keys is compared.
+HOSPITAL_BLOCKERS = [
+    (column_key("State"), column_key("Provider State")),
+    (zip_key("ZIP Code"), zip_key("Provider Zip Code")),
+    (column_key("City", "State"),
+     column_key("Provider City", "Provider State")),
+]
+
+
+def build_text(df, cols):
+    """ Combine the match columns into a single string per record
+    """
+    parts = [df[c].fillna("").astype(str).str.upper() for c in cols]
+    return reduce(lambda a, b: a + " " + b, parts)
+
+
+def build_blocks(left_keys, right_keys):
+    """ Return a list of (left positions, right positions) for every key
+    that appears on both sides
+    """
+    codes, _ = pd.factorize(pd.concat([left_keys, right_keys],
+                                      ignore_index=True))
+    left_codes = codes[:len(left_keys)]
+    right_codes = codes[len(left_keys):]
+    left_groups = pd.Series(np.arange(len(left_codes))).groupby(
+        left_codes).indices
+    right_groups = pd.Series(np.arange(len(right_codes))).groupby(
+        right_codes).indices
+    return [(left_groups[c], right_groups[c])
+            for c in left_groups if c in right_groups and c >= 0]
+
+
+def pack_tasks(blocks, task_pairs=TASK_PAIRS):
+    """ Group small blocks together so each task has a reasonable amount of
+    work. Large blocks get a task of their own.
+    """
+    tasks = []
+    current = []
+    pairs = 0
+    blocks = sorted(blocks, key=lambda b: -len(b[0]) * len(b[1]))
+    for left_idx, right_idx in blocks:
+        current.append((left_idx, right_idx))
+        pairs += len(left_idx) * len(right_idx)
+        if pairs >= task_pairs:
+            tasks.append(current)
+            current = []
+            pairs = 0
+    if current:
+        tasks.append(current)
+    return tasks
+
+
+def init_worker(left_vectors, right_vectors):
+    """ Store the TF-IDF matrices in each worker process
+    """
+    global _left_vectors, _right_vectors
+    _left_vectors = left_vectors
+    _right_vectors = right_vectors
+
+
+def score_blocks(blocks, chunk_size=CHUNK_SIZE):
+    """ Find the best right record for each left record in the blocks.
+    Returns arrays of left positions, right positions and scores
+    """
+    lefts, rights, scores = [], [], []
+    for left_idx, right_idx in blocks:
+        right_t = _right_vectors[right_idx].T.tocsc()
+        for start in range(0, len(left_idx), chunk_size):
+            chunk = left_idx[start:start + chunk_size]
+            sims = (_left_vectors[chunk] @ right_t).tocsr()
+            best = np.asarray(sims.argmax(axis=1)).ravel()
+            best_score = sims.max(axis=1).toarray().ravel()
+            lefts.append(chunk)
+            rights.append(right_idx[best])
+            scores.append(best_score)
+    if not lefts:
+        empty = np.array([], dtype=np.int64)
+        return empty, empty, np.array([], dtype=np.float32)
+    return np.concatenate(lefts), np.concatenate(rights), np.concatenate(scores)
+
+
+def fuzzy_left_join(df_left, df_right, left_on, right_on, left_id_col=None,
+                    right_id_col=None, blockers=None, workers=None,
+                    ngram_range=(3, 3), min_score=0.0):
+    """ Match each record in df_left to the most similar record in df_right.
+
+    Args:
+        df_left, df_right = DataFrames to match
+        left_on, right_on = list of columns to compare on each side
+        left_id_col, right_id_col = id columns, the index is used if None
+        blockers = list of (left key function, right key function) pairs.
+                   None compares every record with every other record
+        workers = number of worker processes. 1 runs in this process
+        ngram_range = size of the character n-grams
+        min_score = matches below this score are dropped
+    Returns:
+        a DataFrame in the same layout as fuzzymatcher.fuzzy_left_join
+    """
+    df_left = df_left.reset_index(drop=left_id_col is not None)
+    df_right = df_right.reset_index(drop=right_id_col is not None)
+    left_id_col = left_id_col or df_left.columns[0]
+    right_id_col = right_id_col or df_right.columns[0]
+
+    # Fit on both sides so the weights are shared
+    left_text = build_text(df_left, left_on)
+    right_text = build_text(df_right, right_on)
+    vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=ngram_range,
+                                 dtype=np.float32)
+    vectorizer.fit(pd.concat([left_text, right_text]))
+    left_vectors = vectorizer.transform(left_text)
+    right_vectors = vectorizer.transform(right_text)
+
+    if blockers is None:
+        blockers = [(lambda df: pd.Series("", index=df.index),
+                     lambda df: pd.Series("", index=df.index))]
+    blocks = []
+    for left_key, right_key in blockers:
+        blocks.extend(build_blocks(left_key(df_left).reset_index(drop=True),
+                                   right_key(df_right).reset_index(drop=True)))
+    tasks = pack_tasks(blocks)
+
+    if workers == 1:
+        init_worker(left_vectors, right_vectors)
+        results = [score_blocks(t) for t in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=workers,
+                                 initializer=init_worker,
+                                 initargs=(left_vectors,
+                                           right_vectors)) as executor:
+            results = list(executor.map(score_blocks, tasks))
+
+    # A record can be in several blocks so keep its best match overall
+    best_score = np.full(len(df_left), -1.0)
+    best_right = np.full(len(df_left), -1, dtype=np.int64)
+    for lefts, rights, scores in results:
+        order = np.argsort(scores, kind="stable")
+        lefts, rights, scores = lefts[order], rights[order], scores[order]
+        better = scores > best_score[lefts]
+        # Later assignments win so the highest score for a record is kept
+        best_score[lefts[better]] = scores[better]
+        best_right[lefts[better]] = rights[better]
+    matched = (best_right >= 0) & (best_score > min_score)
+
+    result = df_left.copy()
+    result.insert(0, "__id_right", np.nan)
+    result.insert(0, "__id_left", df_left[left_id_col].values)
+    result.insert(0, "best_match_score", np.where(matched, best_score, np.nan))
+    right_rows = df_right.iloc[np.where(matched, best_right, 0)].reset_index(
+        drop=True)
+    right_rows = right_rows.where(pd.Series(matched), axis=0)
+    result["__id_right"] = right_rows[right_id_col].values
+    for col in df_right.columns:
+        name = col if col not in result.columns else "{}_right".format(col)
+        result[name] = right_rows[col].values
+    return result
+
+
+def scale_data(df, copies):
+    """ Make a larger data set by stacking copies of the data.
+    Each copy is put in its own region so the blocks keep a realistic size
+    """
+    frames = []
+    for i in range(copies):
+        frame = df.copy()
+        frame["Region"] = str(i)
+        frames.append(frame)
+    scaled = pd.concat(frames, ignore_index=True)
+    scaled.insert(0, "Row_Id", np.arange(len(scaled)))
+    return scaled
+
+
+def benchmark(accounts, reimbursement, scales, workers=None):
+    """ Time the matching as the data grows and compare the number of
+    candidate pairs to a full comparison
+    """
+    left_on = ["Facility Name", "Address", "City", "State"]
+    right_on = ["Provider Name", "Provider Street Address", "Provider City",
+                "Provider State"]
+    blockers = [
+        (column_key("Region", "State"), column_key("Region", "Provider State")),
+        (zip_key("ZIP Code", "Region"), zip_key("Provider Zip Code", "Region")),
+    ]
+    results = []
+    for scale in scales:
+        left = scale_data(accounts, scale)
+        right = scale_data(reimbursement, scale)
+        start = time.perf_counter()
+        fuzzy_left_join(left, right, left_on, right_on, "Row_Id", "Row_Id",
+                        blockers=blockers, workers=workers)
+        elapsed = time.perf_counter() - start
+        candidates = sum(len(l) * len(r)
+                         for left_key, right_key in blockers
+                         for l, r in build_blocks(left_key(left),
+                                                  right_key(right)))
+        results.append({"scale": scale,
+                        "left_rows": len(left),
+                        "right_rows": len(right),
+                        "candidate_pairs": candidates,
+                        "all_pairs": len(left) * len(right),
+                        "seconds": elapsed,
+                        "rows_per_second": len(left) / elapsed})
+    return pd.DataFrame(results)
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Match hospital accounts to reimbursement records')
+    parser.add_argument('accounts', help='hospital_account_info.csv')
+    parser.add_argument('reimbursement', help='hospital_reimbursement.csv')
+    parser.add_argument('-o', help='Output csv file for the matches')
+    parser.add_argument('--workers', type=int, default=None,
+                        help='Number of worker processes')
+    parser.add_argument('--benchmark', type=int, nargs='*',
+                        help='Scale factors to benchmark, for example 1 10 100')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    hospital_accounts = pd.read_csv(args.accounts)
+    hospital_reimbursement = pd.read_csv(args.reimbursement)
+    if args.benchmark:
+        print(benchmark(hospital_accounts, hospital_reimbursement,
+                        args.benchmark, args.workers).to_string(index=False))
+    else:
+        left_on = ["Facility Name", "Address", "City", "State"]
+        right_on = ["Provider Name", "Provider Street Address",
+                    "Provider City", "Provider State"]
+        matched_results = fuzzy_left_join(hospital_accounts,
+                                          hospital_reimbursement,
+                                          left_on,
+                                          right_on,
+                                          left_id_col='Account_Num',
+                                          right_id_col='Provider_Num',
+                                          blockers=HOSPITAL_BLOCKERS,
+                                          workers=args.workers)
+        cols = ["best_match_score", "Facility Name", "Provider Name",
+                "Address", "Provider Street Address"]
+        print(matched_results[cols].sort_values(by=['best_match_score'],
+                                                ascending=False).head())
+        if args.o:
+            matched_results.to_csv(args.o, index=False)
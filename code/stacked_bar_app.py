@@ -7,11 +7,10 @@ import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
 import pandas as pd
+from data_loader import load
 
 # Read in the Excel file
-df = pd.read_excel(
-    "https://github.com/chris1610/pbpython/blob/master/data/salesfunnel.xlsx?raw=True"
-)
+df = load("salesfunnel.xlsx")
 
 # Pivot the data to get it a summary format
 pv = pd.pivot_table(
@@ -6,12 +6,11 @@ import dash
 import dash_core_components as dcc
 import dash_html_components as html
 import plotly.graph_objs as go
-import pandas as pd
+from data_loader import load
+from app_data import funnel_pivot
 
 # Read in the data from Excel
-df = pd.read_excel(
-    "https://github.com/chris1610/pbpython/blob/master/data/salesfunnel.xlsx?raw=True"
-)
+df = load("salesfunnel.xlsx")
 
 # Get a list of all the avilable managers
 mgr_options = df["Manager"].unique()
@@ -43,18 +42,7 @@ app.layout = html.Div([
     dash.dependencies.Output('funnel-graph', 'figure'),
     [dash.dependencies.Input('Manager', 'value')])
 def update_graph(Manager):
-    if Manager == "All Managers":
-        df_plot = df.copy()
-    else:
-        df_plot = df[df['Manager'] == Manager]
-
-    pv = pd.pivot_table(
-        df_plot,
-        index=['Name'],
-        columns=["Status"],
-        values=['Quantity'],
-        aggfunc=sum,
-        fill_value=0)
+    pv = funnel_pivot(df, Manager)
 
     trace1 = go.Bar(x=pv.index, y=pv[('Quantity', 'declined')], name='Declined')
     trace2 = go.Bar(x=pv.index, y=pv[('Quantity', 'pending')], name='Pending')
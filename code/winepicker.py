@@ -12,6 +12,7 @@ from bokeh.models.widgets import Slider, Select, TextInput, Div
 from bokeh.models import WheelZoomTool, SaveTool, LassoSelectTool
 from bokeh.io import curdoc
 from functools import lru_cache
+from app_data import filter_reviews
 
 
 # Define a cached function to read in the CSV file and return a dataframe
@@ -83,15 +84,7 @@ def select_reviews():
     province_val = province.value
     title_val = title.value
 
-    # Filter by price and province
-    if province_val == "All":
-        selected = df[df.price <= max_price]
-    else:
-        selected = df[(df.province == province_val) & (df.price <= max_price)]
-
-    # Further filter by string in title if it is provided
-    if title_val != "":
-        selected = selected[selected.title.str.contains(title_val) == True]
+    selected = filter_reviews(df, max_price, province_val, title_val)
 
     # Example showing how to update the description
     desc.text = "Province: {} and Price < {}".format(province_val, max_price)
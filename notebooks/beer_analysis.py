@@ -3,17 +3,14 @@ Beer Analysis - Using Jupyter Code Cells
 Accompanying article on https://pbpython.com/notebook-alternative.html
 """
 # %%
-import pandas as pd
 import seaborn as sns
 import plotly.express as px
+from beer_data import load_data, category_contains
 # %%
 # Load in the Craft Beer analysis
-df_beers = pd.read_csv(
-    'https://github.com/nickhould/craft-beers-dataset/blob/master/data/processed/beers.csv?raw=True',
-    index_col=0)
-df_breweries = pd.read_csv(
-    'https://github.com/nickhould/craft-beers-dataset/blob/master/data/processed/breweries.csv?raw=True',
-    index_col=0)
+# The files are downloaded once and then read from the local parquet cache
+df_beers = load_data('beers')
+df_breweries = load_data('breweries')
 # %%
 sns.set_style('whitegrid')
 
@@ -30,12 +27,8 @@ df_beers.info()
 df_breweries.info()
 
 # %%
-all_beer = pd.merge(df_beers,
-                    df_breweries,
-                    how='left',
-                    left_on="brewery_id",
-                    right_on="id",
-                    suffixes=('_beer', '_brewery'))
+# The merged data is built along with the cache so just read it in
+all_beer = load_data('all_beer')
 
 # %%
 all_beer.head()
@@ -51,7 +44,7 @@ all_beer.info()
 all_beer['ounces'].plot(kind='hist', title='Beer Size')
 
 # %%
-all_beer['IPA'] = all_beer['style'].str.contains('IPA', case=False)
+all_beer['IPA'] = category_contains(all_beer['style'], 'IPA', case=False)
 
 # %%
 all_beer['IPA'].value_counts()
@@ -80,7 +73,7 @@ fig.show()
 
 # %%
 # Do some analysis on MN beers
-mn_beer = all_beer[all_beer['state'].str.contains('MN')].copy()
+mn_beer = all_beer[category_contains(all_beer['state'], 'MN', case=True)].copy()
 
 # %%
 all_beer['state'].value_counts()
@@ -0,0 +1,88 @@
+"""
+Load the craft beer data set used in beer_analysis.py from a local cache.
+
+The first time the data is requested, the beers and breweries files are
+downloaded from GitHub, converted to compact types and joined together.
+All three frames are saved as parquet files so later runs read them back
+in a fraction of the time and memory.
+"""
+from pathlib import Path
+import numpy as np
+import pandas as pd
+
+BEERS_URL = 'https://github.com/nickhould/craft-beers-dataset/blob/master/data/processed/beers.csv?raw=True'
+BREWERIES_URL = 'https://github.com/nickhould/craft-beers-dataset/blob/master/data/processed/breweries.csv?raw=True'
+CACHE_DIR = Path(__file__).parent / 'beer_cache'
+
+# Types to use for each of the columns
+BEER_TYPES = {
+    'abv': 'float32',
+    'ibu': 'float32',
+    'ounces': 'float32',
+    'id': 'int32',
+    'brewery_id': 'int32',
+    'style': 'category'
+}
+BREWERY_TYPES = {'id': 'int32', 'city': 'category', 'state': 'category'}
+
+
+def convert_types(df, types):
+    """ Convert the columns in the DataFrame to the types in the dictionary.
+    Text is stripped of whitespace before being converted to a category
+    """
+    for col, dtype in types.items():
+        if col not in df.columns:
+            continue
+        if dtype == 'category':
+            df[col] = df[col].str.strip().astype('category')
+        else:
+            df[col] = df[col].astype(dtype)
+    return df
+
+
+def build_cache(cache_dir=CACHE_DIR):
+    """ Download the raw files, convert the types, join them and save
+    everything to the cache directory
+    """
+    cache_dir = Path(cache_dir)
+    cache_dir.mkdir(parents=True, exist_ok=True)
+    df_beers = convert_types(pd.read_csv(BEERS_URL, index_col=0), BEER_TYPES)
+    df_breweries = pd.read_csv(BREWERIES_URL, index_col=0)
+    if 'id' not in df_breweries.columns:
+        # The brewery id is the index in some versions of the file
+        df_breweries['id'] = df_breweries.index
+    df_breweries = convert_types(df_breweries, BREWERY_TYPES)
+    all_beer = pd.merge(df_beers,
+                        df_breweries,
+                        how='left',
+                        left_on="brewery_id",
+                        right_on="id",
+                        suffixes=('_beer', '_brewery'))
+    # The merge turns categories into objects if there are missing breweries
+    all_beer = convert_types(all_beer, {'city': 'category',
+                                        'state': 'category'})
+    df_beers.to_parquet(cache_dir / 'beers.parquet')
+    df_breweries.to_parquet(cache_dir / 'breweries.parquet')
+    all_beer.to_parquet(cache_dir / 'all_beer.parquet')
+
+
+def load_data(name='all_beer', cache_dir=CACHE_DIR, refresh=False):
+    """ Return one of the cached DataFrames: beers, breweries or all_beer.
+    The cache is built the first time or when refresh is True
+    """
+    cache_file = Path(cache_dir) / f'{name}.parquet'
+    if refresh or not cache_file.exists():
+        build_cache(cache_dir)
+    return pd.read_parquet(cache_file)
+
+
+def category_contains(series, pattern, case=False):
+    """ Vectorized version of series.str.contains for a categorical series.
+    The search is only run on the unique categories and then mapped back to
+    every row using the codes
+    """
+    matches = np.asarray(series.cat.categories.str.contains(pattern,
+                                                            case=case))
+    # Missing values have a code of -1 and never match
+    codes = series.cat.codes.to_numpy()
+    return pd.Series((codes >= 0) & matches[codes], index=series.index)
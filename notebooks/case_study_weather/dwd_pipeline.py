@@ -0,0 +1,207 @@
+"""
+Build the hourly temperature data set straight from the DWD station archives.
+
+This replaces steps 2 and 3 of the case study notebooks. Instead of
+extracting every produkt file to the import folder and growing one
+DataFrame a file at a time, each stundenwerte_TU_*_hist.zip archive is
+read directly out of the zip, parsed with fixed types and date format and
+written to parquet files partitioned by station and year. The archives are
+processed in parallel and a checksum of each one is saved so a rerun only
+converts the archives that are new or have changed.
+
+The partitioned data can be read back lazily with load_observations or
+turned into the wide frame saved by the 3-dwd_konverter_build_df notebook
+with build_main_df.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+from pathlib import Path
+from zipfile import ZipFile
+import pandas as pd
+
+DOWNLOAD_FOLDER = Path(__file__).parent / 'download'
+PARQUET_FOLDER = Path(__file__).parent / 'parquet'
+OUT_FILE = Path(__file__).parent / 'export_uncleaned' / 'to_clean.pkl'
+ARCHIVE_PATTERN = 'stundenwerte_TU_*_hist.zip'
+MEMBER_PATTERN = re.compile('produkt.*')
+# Checksums of the archives that have already been converted. The leading
+# underscore keeps pyarrow from reading it as part of the data
+STATE_FILE = '_archives.json'
+# Observations before this date are not used
+MIN_DATE = '2007-01-01'
+
+# Only read the columns that are kept. QN_9, RF_TU and eor are dropped
+COLUMNS = ['STATIONS_ID', 'MESS_DATUM', 'TT_TU']
+DTYPES = {'STATIONS_ID': 'int32', 'MESS_DATUM': 'str', 'TT_TU': 'float32'}
+DATE_FORMAT = '%Y%m%d%H'
+
+
+def archive_checksum(path, block_size=1 << 20):
+    """ sha256 of a file, read in blocks
+    """
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(block_size), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def read_archive(path, min_date=MIN_DATE):
+    """ Read the produkt file inside a station archive without extracting it
+    """
+    with ZipFile(path, 'r') as archive:
+        member = next(filter(MEMBER_PATTERN.match, archive.namelist()))
+        with archive.open(member) as f:
+            df = pd.read_csv(f, sep=';', usecols=COLUMNS, dtype=DTYPES,
+                             skipinitialspace=True)
+    df['MESS_DATUM'] = pd.to_datetime(df['MESS_DATUM'], format=DATE_FORMAT)
+    if min_date is not None:
+        df = df[df['MESS_DATUM'] >= min_date]
+    return df
+
+
+def convert_archive(path, out_dir=PARQUET_FOLDER, min_date=MIN_DATE):
+    """ Write one archive to out_dir/STATIONS_ID=<id>/year=<year>/
+    Returns the station ids and number of rows written
+    """
+    df = read_archive(path, min_date)
+    stations = sorted(int(s) for s in df['STATIONS_ID'].unique())
+    years = df['MESS_DATUM'].dt.year
+    for (station, year), group in df.groupby([df['STATIONS_ID'], years]):
+        part_dir = Path(out_dir) / f'STATIONS_ID={station}' / f'year={year}'
+        part_dir.mkdir(parents=True, exist_ok=True)
+        # The partition columns are stored in the folder names
+        group.drop(columns='STATIONS_ID').to_parquet(
+            part_dir / 'data.parquet', index=False)
+    return stations, len(df)
+
+
+def _convert_archive(args):
+    """ Unpack the arguments for use with the process pool
+    """
+    return convert_archive(*args)
+
+
+def remove_stations(out_dir, stations):
+    """ Delete all of the partitions for the stations
+    """
+    for station in stations:
+        shutil.rmtree(Path(out_dir) / f'STATIONS_ID={station}',
+                      ignore_errors=True)
+
+
+def read_state(out_dir):
+    """ Return the saved checksums, or an empty dict on the first run
+    """
+    state_file = Path(out_dir) / STATE_FILE
+    if state_file.exists():
+        return json.loads(state_file.read_text())
+    return {}
+
+
+def write_state(out_dir, state):
+    """ Save the state next to the data. Write to a temp file and rename so
+    an interrupted run never leaves a partial file
+    """
+    state_file = Path(out_dir) / STATE_FILE
+    tmp_file = state_file.with_suffix('.tmp')
+    tmp_file.write_text(json.dumps(state, indent=2, sort_keys=True))
+    os.replace(tmp_file, state_file)
+
+
+def build_parquet(download_folder=DOWNLOAD_FOLDER, out_dir=PARQUET_FOLDER,
+                  min_date=MIN_DATE, workers=None):
+    """ Convert any new or changed archives in download_folder to parquet.
+    Returns the names of the archives that were converted
+    """
+    out_dir = Path(out_dir)
+    out_dir.mkdir(parents=True, exist_ok=True)
+    state = read_state(out_dir)
+    archives = {p.name: p for p in sorted(Path(download_folder).glob(
+        ARCHIVE_PATTERN))}
+
+    # Archives that are no longer downloaded are removed from the data
+    for name in set(state) - set(archives):
+        remove_stations(out_dir, state.pop(name)['stations'])
+
+    checksums = {name: archive_checksum(p) for name, p in archives.items()}
+    todo = [name for name in archives
+            if state.get(name, {}).get('checksum') != checksums[name]
+            or state[name].get('min_date') != min_date]
+    for name in todo:
+        # Clear out the old partitions so years that are gone do not linger
+        if name in state:
+            remove_stations(out_dir, state.pop(name)['stations'])
+    write_state(out_dir, state)
+
+    tasks = [(archives[name], out_dir, min_date) for name in todo]
+    # The pool only starts processes if it is used
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        mapper = map if workers == 1 else executor.map
+        # Save the state after each archive so an interrupted run resumes
+        for name, (stations, rows) in zip(todo, mapper(_convert_archive,
+                                                       tasks)):
+            state[name] = {'checksum': checksums[name],
+                           'stations': stations,
+                           'rows': rows,
+                           'min_date': min_date}
+            write_state(out_dir, state)
+            print(f'Finished file: {name} ({rows} rows)')
+    return todo
+
+
+def load_observations(out_dir=PARQUET_FOLDER, stations=None, years=None,
+                      columns=None):
+    """ Read the partitioned data back as one long DataFrame.
+    Only the partitions for the requested stations and years are read
+    """
+    filters = []
+    if stations is not None:
+        filters.append(('STATIONS_ID', 'in', list(stations)))
+    if years is not None:
+        filters.append(('year', 'in', list(years)))
+    df = pd.read_parquet(out_dir, columns=columns, filters=filters or None)
+    # The partition columns come back as categories
+    for col in ['STATIONS_ID', 'year']:
+        if col in df.columns:
+            df[col] = df[col].astype('int32')
+    return df
+
+
+def build_main_df(observations):
+    """ Same wide frame as the 3-dwd_konverter_build_df notebook.
+    One row per hour and one TT_TU column per station
+    """
+    main_df = observations.set_index(['MESS_DATUM', 'STATIONS_ID'])[['TT_TU']]
+    main_df = main_df[~main_df.index.duplicated(keep='last')]
+    return main_df.unstack('STATIONS_ID')
+
+
+def parse_args():
+    """ Setup the arguments for the script
+    """
+    parser = argparse.ArgumentParser(
+        description='Convert the DWD station archives to parquet')
+    parser.add_argument('--download', default=DOWNLOAD_FOLDER,
+                        help='Folder with the downloaded zip files')
+    parser.add_argument('--parquet', default=PARQUET_FOLDER,
+                        help='Folder for the partitioned parquet files')
+    parser.add_argument('--min-date', default=MIN_DATE)
+    parser.add_argument('-j', '--workers', type=int, default=None,
+                        help='Number of worker processes')
+    parser.add_argument('-o', default=OUT_FILE,
+                        help='Pickle file for the wide frame used in step 4')
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    build_parquet(args.download, args.parquet, args.min_date, args.workers)
+    main_df = build_main_df(load_observations(args.parquet))
+    print(f'Shape of the main_df is: {main_df.shape}')
+    main_df.to_pickle(args.o)